@@ -1,18 +1,24 @@
 import base64
+import csv
+import itertools
+import json
 import logging
-import uuid
 import threading
-import time
+import uuid
 from datetime import datetime, date
-from io import BytesIO
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, jsonify, flash
+from io import BytesIO, StringIO
+import numpy as np
+from flask import Flask, Response, g, render_template, stream_with_context, request, redirect, url_for, send_from_directory, jsonify, flash
 from werkzeug.utils import secure_filename
-from PIL import Image, ImageDraw
 from config import config
 from services.face_service import FaceService
+from services.face_processor import FaceProcessor
 from services.storage_service import StorageService
 from services.attendance_service import AttendanceService
+from services.entity_loader import EntityLoader
 from services.session_manager import SessionManager
+from services.sqlite_session_store import SQLiteSessionStore
+from services.job_queue import JobQueue, QueueFullError
 from models.student import Student
 from models.department import Department
 from models.faculty import Faculty
@@ -30,16 +36,25 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Initialize services
+# The face processing pool is started first so its workers fork before any other threads exist
+face_processor = FaceProcessor()
 storage_service = StorageService()
 face_service = FaceService()
 attendance_service = AttendanceService()
-session_manager = SessionManager()
+# Sessions must live in a shared store when the app runs in several worker processes
+session_manager = SQLiteSessionStore() if config.SESSION_BACKEND == 'sqlite' else SessionManager()
 
 # Helper functions
 def allowed_file(filename):
     """Check if file has allowed extension"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in config.ALLOWED_EXTENSIONS
 
+def entity_loader():
+    """Batching loader for students, subjects and faculty, shared within a request"""
+    if 'entity_loader' not in g:
+        g.entity_loader = EntityLoader(storage_service)
+    return g.entity_loader
+
 def process_image_for_registration(image_data, student_id, name):
     """Process image for student registration"""
     try:
@@ -64,22 +79,29 @@ def process_image_for_registration(image_data, student_id, name):
         raise
 
 def start_processing_image(image_data, subject_id, faculty_id):
-    """Start processing image in background and return session ID"""
+    """
+    Queue image processing in background and return session ID
+    
+    Raises QueueFullError if the face job queue is saturated.
+    """
     try:
         # Create a new session with binary image data
         session_id = session_manager.create_session(image_data)
         session_manager.update_session(session_id, {
+            'status': 'queued',
             'metadata': {
                 'subject_id': subject_id,
                 'faculty_id': faculty_id
             }
         })
         
-        # Add debug log
-        logger.info(f"Created session {session_id} and started processing")
-        # Start a background thread to process faces
-        threading.Thread(target=process_faces_background, args=(session_id,)).start()
+        try:
+            position = face_job_queue.submit(session_id)
+        except QueueFullError:
+            session_manager.delete_session(session_id)
+            raise
         
+        logger.info(f"Created session {session_id} at queue position {position}")
         return session_id
     except Exception as e:
         logger.error(f"Error starting image processing: {e}")
@@ -92,9 +114,12 @@ def process_faces_background(session_id):
         logger.error(f"Session {session_id} not found")
         return
     
+    session_manager.update_session(session_id, {'status': 'processing'})
+    
+    image_data = None
     try:
         # Get the image data from the session
-        image_data = session_data['image']
+        image_data = session_manager.get_blob(session_id, 'image')
         
         # Get metadata from session
         metadata = session_data.get('metadata', {})
@@ -127,112 +152,98 @@ def process_faces_background(session_id):
         # Track which students are present (will be updated during face detection)
         present_student_ids = set()
         
-        # Detect faces in the image using FaceService
-        np_image, face_locations = face_service.detect_faces(image_data)
+        # Detect, encode and crop all faces in a worker process
+        detection = face_processor.detect_and_encode(image_data)
+        face_locations = detection['face_locations']
+        face_encodings = detection['encodings']
+        face_crops = detection['face_crops']
         
-        # Process each face
+        # The raw upload is no longer needed once decoded; keep only a size-capped
+        # preview for the annotated view, rendered lazily on request
+        image_data = None
+        session_manager.update_session(session_id, {
+            'image': None,
+            'preview': detection['preview'],
+            'preview_scale': detection['preview_scale']
+        })
+        
+        # Process each face; crops are kept as raw JPEG bytes and served by URL
         processed_faces = []
+        face_images = {}
         
-        # Track names and student_ids for later drawing all faces at once
-        all_names = []
-        all_student_ids = []
+        # Track boxes, names and student_ids for drawing the annotated image later
+        face_boxes = []
+        
+        # Restrict matching to the enrolled roster unless configured otherwise
+        candidate_ids = enrolled_student_ids if config.FACE_MATCH_SCOPE == 'subject' else None
         
         # Process detected faces and mark present students
         if face_locations:
+            # Match all faces in one batch using StorageService
+            face_matches = storage_service.find_matching_faces(
+                face_encodings,
+                top_k=1,
+                subject_id=subject_id,
+                candidate_ids=candidate_ids
+            )
+            
             for i, face_location in enumerate(face_locations):
                 try:
-                    # Get face encoding using FaceService
-                    face_encoding = face_service.encode_face(np_image, face_location)
+                    if np.isnan(face_encodings[i]).any():
+                        raise ValueError("Could not encode face")
                     
-                    # Find matching face using StorageService
-                    student_id, name, score = storage_service.find_matching_face(face_encoding)
+                    student_id, name, score = storage_service.best_match(face_matches[i])
                     
                     # If a valid student was identified (student_id is not None)
                     if student_id:
-                        # Add to set of present students
+                        # Add to set of present students; attendance is written in bulk at the end
                         present_student_ids.add(student_id)
-                        
-                        # Mark attendance for this student
-                        if subject_id:
-                            # Mark the student as present in this subject
-                            attendance_result = attendance_service.mark_attendance(
-                                student_id=student_id,
-                                subject_id=subject_id,
-                                faculty_id=faculty_id,
-                                status="present"
-                            )
-                            
-                            # Log the attendance result
-                            if attendance_result:
-                                logger.info(f"Marked attendance for student {student_id} ({name}) in subject {subject_id}")
-                            else:
-                                logger.info(f"Attendance already marked or error for student {student_id} in subject {subject_id}")
-                        else:
-                            logger.warning(f"No subject_id provided in metadata, cannot mark attendance for {student_id}")
-
-                    # Add to tracking lists
-                    all_names.append(name)
-                    all_student_ids.append(student_id)
-                    
-                    # Crop face image
-                    top, right, bottom, left = face_location
-                    face_crop = face_service.crop_face(Image.fromarray(np_image), face_location)
+                        logger.info(f"Recognized student {student_id} ({name}) in subject {subject_id}")
+
+                    # Add to tracking list
+                    face_boxes.append((face_location, name, student_id))
                     
                     # Add to processed faces
+                    if face_crops[i] is not None:
+                        face_images[i] = face_crops[i]
                     processed_faces.append({
                         'id': i,
                         'student_id': student_id,
                         'name': name,
-                        'face_img': face_crop,
+                        'face_url': f"/session/{session_id}/face/{i}.jpg" if i in face_images else None,
                         'processed_at': datetime.now().isoformat()
                     })
                     
-                    # Update session with new face - important for real-time updates
+                    # Update session with new face - pushed to progress streams right away
                     session_manager.update_session(session_id, {
                         'processed_faces': processed_faces,
+                        'face_images': face_images,
                         'status': 'processing'  # Ensure status is set
                     })
                     
-                    # Add a small delay to make updates visible in UI
-                    time.sleep(0.2)
-                    
                 except Exception as e:
                     logger.error(f"Error processing face {i}: {str(e)}")
                     # Continue with next face
-            
-            # Draw all face rectangles at once using FaceService
-            pil_image_with_faces = face_service.draw_face_rectangles(np_image, face_locations, all_names, all_student_ids)
-            
-            # Convert processed image to base64
-            full_image_data = face_service.image_to_base64(pil_image_with_faces)
         else:
             logger.warning(f"No faces detected in session {session_id}")
-            full_image_data = None
         
         # Find absent students (enrolled but not present)
         absent_student_ids = [sid for sid in enrolled_student_ids if sid not in present_student_ids]
         
-        # Mark absent students
-        absent_students_count = 0
-        for student_id in absent_student_ids:
-            try:
-                attendance_result = attendance_service.mark_attendance(
-                    student_id=student_id,
-                    subject_id=subject_id,
-                    faculty_id=faculty_id,
-                    status="absent"
-                )
-                
-                if attendance_result:
-                    absent_students_count += 1
-                    logger.info(f"Marked student {student_id} absent for subject {subject_id}")
-            except Exception as e:
-                logger.error(f"Error marking student {student_id} absent: {str(e)}")
-        
+        # Mark present and absent students in one bulk write
+        student_statuses = {student_id: "present" for student_id in present_student_ids}
+        student_statuses.update({student_id: "absent" for student_id in absent_student_ids})
+        marked_count = attendance_service.mark_attendance_bulk(student_statuses, subject_id, faculty_id)
+        if marked_count < len(student_statuses):
+            logger.error(f"Marked attendance for {marked_count} of {len(student_statuses)} students in subject {subject_id}")
+        else:
+            logger.info(f"Marked attendance for {marked_count} students in subject {subject_id}")
+        absent_students_count = len(absent_student_ids)
+
         # Mark processing as completed
         session_manager.update_session(session_id, {
             'status': 'completed',
-            'full_image': full_image_data,
+            'face_boxes': face_boxes,
             'total_faces': len(processed_faces),
             'present_count': len(present_student_ids),
             'absent_count': absent_students_count
@@ -245,6 +256,45 @@ def process_faces_background(session_id):
             'status': 'error',
             'error': str(e)
         })
+    finally:
+        # Early returns and errors leave the upload in the session; release it
+        if image_data is not None:
+            session_manager.update_session(session_id, {'image': None})
+
+# Bounded queue of face sessions, served by a fixed number of threads
+face_job_queue = JobQueue(
+    process_faces_background,
+    workers=config.FACE_SESSION_THREADS,
+    max_depth=config.FACE_QUEUE_MAX_DEPTH,
+    initial_estimate=config.FACE_JOB_ESTIMATE,
+    name='face-session'
+)
+
+def busy_response(retry_after):
+    """503 response telling the client when to retry"""
+    response = app.response_class(
+        f"Attendance processing is busy, please retry in {retry_after} seconds",
+        status=503
+    )
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def session_memory_available(incoming_bytes):
+    """
+    Check whether an upload fits in the session memory budget
+    
+    Finished sessions can be evicted to make room; queued and processing
+    sessions hold their images until they finish, so they cannot.
+    """
+    stats = session_manager.memory_stats()
+    in_flight = sum(
+        status_stats['bytes'] for status, status_stats in stats['by_status'].items()
+        if status not in ('completed', 'error')
+    )
+    if in_flight + incoming_bytes <= stats['budget_bytes']:
+        return True
+    logger.warning(f"Rejecting upload of {incoming_bytes} bytes: {in_flight} bytes of sessions in flight")
+    return False
 
 # Route handlers
 @app.route('/')
@@ -285,28 +335,21 @@ def dashboard():
         # Get all subjects
         subjects = storage_service.get_all_subjects()
         
-        # Get attendance summaries for all students
+        # Get attendance summaries for all students and the number of class days in one query
+        summaries, total_days = attendance_service.get_all_student_summaries()
+        department_names = {d.dept_id: d.name for d in departments}
         attendance_results = []
         for student in students:
-            summary = attendance_service.get_student_attendance_summary(student.student_id)
+            summary = summaries.get(student.student_id, {})
             attendance_results.append({
                 'student_id': student.student_id,
                 'name': student.name,
-                'department': next((d.name for d in departments if d.dept_id == student.department_id), 'Unknown'),
-                'days_present': summary['present_count'],
-                'total_days': summary['total_classes'],
-                'percentage': summary['attendance_percentage']
+                'department': department_names.get(student.department_id, 'Unknown'),
+                'days_present': summary.get('present_count', 0),
+                'total_days': summary.get('total_classes', 0),
+                'percentage': summary.get('attendance_percentage', 0)
             })
-        
-        # Calculate total number of attendance days
-        attendance_records = storage_service.get_attendance_records()
-        attendance_dates = set()
-        for att in attendance_records:
-            if hasattr(att, 'date') and att.date:
-                attendance_dates.add(att.date)
-        
-        total_days = len(attendance_dates)
-        
+
         return render_template('dashboard.html', 
                              attendance_data=attendance_results,
                              total_days=total_days,
@@ -428,6 +471,12 @@ def upload_file():
     
     subject_id = request.form.get('subject_id', 'default_subject')
     faculty_id = request.form.get('faculty_id')
+    
+    # Reject before reading the image if the queue is already saturated
+    if face_job_queue.is_full():
+        return busy_response(face_job_queue.retry_after())
+    if not session_memory_available(request.content_length or 0):
+        return busy_response(face_job_queue.retry_after())
 
     try:
         # Read the file data
@@ -453,6 +502,8 @@ def upload_file():
                     subject_id=subject_id,
                     faculty_name=faculty_name,
                     subject_name=subject_name)
+    except QueueFullError as e:
+        return busy_response(e.retry_after)
     except Exception as e:
         logger.error(f"Upload error: {str(e)}")
         return f"Error processing image: {str(e)}", 500
@@ -483,19 +534,17 @@ def get_enrolled_students(subject_id):
         
         logger.info(f"Found {len(enrolled_student_ids)} enrolled student IDs for subject {subject_id}")
         
-        # Get details for each enrolled student
+        # Get details for all enrolled students in one query
         students = []
-        for student_id in enrolled_student_ids:
-            student = storage_service.get_student(student_id)
-            if student:
-                students.append({
-                    'student_id': student.student_id,
-                    'name': student.name,
-                    'roll_number': student.roll_number if hasattr(student, 'roll_number') else '',
-                    'email': student.email if hasattr(student, 'email') else ''
-                })
-            else:
-                logger.warning(f"Student {student_id} listed in subject but not found in database")
+        for student in entity_loader().students(enrolled_student_ids):
+            students.append({
+                'student_id': student.student_id,
+                'name': student.name,
+                'roll_number': student.roll_number if hasattr(student, 'roll_number') else '',
+                'email': student.email if hasattr(student, 'email') else ''
+            })
+        if len(students) < len(enrolled_student_ids):
+            logger.warning(f"{len(enrolled_student_ids) - len(students)} students listed in subject {subject_id} not found in database")
         
         logger.info(f"Returning {len(students)} student details for subject {subject_id}")
         
@@ -513,24 +562,213 @@ def get_enrolled_students(subject_id):
             'students': []
         }), 500
 
+def face_status_etag(session_id, version, status, since):
+    """
+    ETag of a face_status response
+    
+    Covers the session version, the requested cursor (delta bodies differ by
+    cursor) and, while queued, the queue position.
+    
+    Returns:
+        Tuple of (etag, queue position or None)
+    """
+    etag = f"{session_id}-{version}-s{since}"
+    position = None
+    if status == 'queued':
+        position = face_job_queue.position(session_id)
+        etag = f"{etag}-q{position}"
+    return etag, position
+
 @app.route('/face_status/<session_id>')
 def face_status(session_id):
-    """API endpoint to get current status of face processing"""
+    """
+    API endpoint to get current status of face processing
+    
+    Pass ?since=<cursor> (the cursor of the previous response) to receive
+    only faces processed after it. Responses carry an ETag of the session
+    version and cursor, and unchanged sessions answer 304 to If-None-Match
+    without counting as a view.
+    """
+    requested_since = request.args.get('since', 0, type=int)
+    current = session_manager.get_version(session_id)
+    if current is None:
+        return jsonify({'error': 'Session not found'}), 404
+    
+    etag, position = face_status_etag(session_id, *current, requested_since)
+    if request.if_none_match.contains_weak(etag):
+        not_modified = app.response_class(status=304)
+        not_modified.set_etag(etag, weak=True)
+        return not_modified
+    
     session_data = session_manager.get_session(session_id)
     if not session_data:
         return jsonify({'error': 'Session not found'}), 404
     
+    status = session_data.get('status', 'unknown')
+    # The session may have moved on since the version check
+    etag, position = face_status_etag(session_id, session_data.get('version', 0), status, requested_since)
+    
+    processed_faces = session_data.get('processed_faces', [])
+    total_faces = len(processed_faces)
+    since = min(max(requested_since, 0), total_faces)
+    
     response = {
-        'status': session_data.get('status', 'unknown'),
-        'processed_faces': session_data.get('processed_faces', []),
+        'status': status,
+        'processed_faces': processed_faces[since:total_faces],
+        'cursor': total_faces,
+        'version': session_data.get('version', 0),
         'error': session_data.get('error'),
-        'full_image': session_data.get('full_image') if session_data.get('status') == 'completed' else None,
-        'total_faces': len(session_data.get('processed_faces', []))
+        'full_image': annotated_image_url(session_id, session_data),
+        'total_faces': total_faces
     }
     
+    if status == 'queued':
+        response['queue_position'] = position
+        response['estimated_wait'] = round(face_job_queue.estimated_wait(position))
+    
     logger.debug(f"Status response for session {session_id}: status={response['status']}, faces={response['total_faces']}")
     
-    return jsonify(response)
+    response = jsonify(response)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def sse_event(event, data):
+    """Format a Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/face_stream/<session_id>')
+def face_stream(session_id):
+    """Server-Sent Events stream pushing each processed face as soon as it is ready"""
+    if session_manager.peek_session(session_id) is None:
+        return jsonify({'error': 'Session not found'}), 404
+    
+    def events():
+        version = None
+        last_status = None
+        sent_faces = 0
+        while True:
+            session_data = session_manager.wait_for_update(session_id, version, timeout=config.SESSION_STREAM_HEARTBEAT)
+            if session_data is None:
+                yield sse_event('done', {'status': 'error', 'error': 'Session not found'})
+                return
+            status = session_data.get('status', 'unknown')
+            if session_data['version'] == version and status != 'queued':
+                yield ": keep-alive\n\n"
+                continue
+            version = session_data['version']
+            
+            processed_faces = session_data.get('processed_faces', [])
+            for face in processed_faces[sent_faces:]:
+                yield sse_event('face', face)
+            sent_faces = len(processed_faces)
+            
+            if status in ('completed', 'error'):
+                # Count the delivered result as a view, like a final poll would
+                session_manager.get_session(session_id)
+                yield sse_event('done', {
+                    'status': status,
+                    'error': session_data.get('error'),
+                    'full_image': annotated_image_url(session_id, session_data),
+                    'total_faces': sent_faces
+                })
+                return
+            
+            # Queued sessions get periodic position updates
+            if status != last_status or status == 'queued':
+                last_status = status
+                event_data = {'status': status}
+                if status == 'queued':
+                    position = face_job_queue.position(session_id)
+                    event_data['queue_position'] = position
+                    event_data['estimated_wait'] = round(face_job_queue.estimated_wait(position))
+                yield sse_event('status', event_data)
+    
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+ANNOTATED_EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+# Serialize rendering per session so concurrent requests render the annotated image once
+ANNOTATED_RENDER_LOCKS = [threading.Lock() for _ in range(config.SESSION_LOCK_STRIPES)]
+
+def annotated_image_url(session_id, session_data):
+    """URL of the annotated image, once a completed session has faces to show"""
+    if session_data.get('status') == 'completed' and session_data.get('face_boxes'):
+        return f"/session/{session_id}/annotated.{ANNOTATED_EXTENSIONS[config.ANNOTATED_FORMAT]}"
+    return None
+
+def image_response(image_bytes, etag, mimetype='image/jpeg'):
+    """Cacheable image response honouring If-None-Match"""
+    response = app.response_class(image_bytes, mimetype=mimetype)
+    response.set_etag(etag)
+    # Session media never changes once written
+    response.headers['Cache-Control'] = 'private, max-age=3600, immutable'
+    return response.make_conditional(request)
+
+@app.route('/session/<session_id>/face/<int:face_id>.jpg')
+def session_face_image(session_id, face_id):
+    """Serve the JPEG crop of a processed face"""
+    face_image = session_manager.get_blob(session_id, 'face_images', face_id)
+    if face_image is None:
+        return "Face image not found", 404
+    return image_response(face_image, f"{session_id}-face-{face_id}")
+
+@app.route('/session/<session_id>/annotated.<ext>')
+def session_annotated_image(session_id, ext):
+    """
+    Serve the image with all detected faces annotated
+    
+    Rendered from the stored boxes on first request and memoized in the session.
+    """
+    session_data = session_manager.peek_session(session_id)
+    url = annotated_image_url(session_id, session_data) if session_data else None
+    if not url or not url.endswith(f".{ext}"):
+        return "Annotated image not found", 404
+    
+    annotated_image = session_manager.get_blob(session_id, 'annotated_image')
+    if annotated_image is None:
+        with ANNOTATED_RENDER_LOCKS[hash(session_id) % len(ANNOTATED_RENDER_LOCKS)]:
+            # Another request may have rendered it while this one waited
+            annotated_image = session_manager.get_blob(session_id, 'annotated_image')
+            if annotated_image is None:
+                preview = session_manager.get_blob(session_id, 'preview')
+                if preview is None:
+                    return "Annotated image not found", 404
+                face_locations, names, student_ids = zip(*session_data['face_boxes'])
+                annotated_image = face_processor.render_annotated(
+                    preview,
+                    session_data['preview_scale'],
+                    list(face_locations),
+                    list(names),
+                    list(student_ids)
+                )
+                # The preview is no longer needed once the annotated image exists
+                session_manager.update_session(session_id, {'annotated_image': annotated_image, 'preview': None})
+    
+    image_bytes, mimetype = annotated_image
+    return image_response(image_bytes, f"{session_id}-annotated", mimetype)
+
+@app.route('/api/sessions/memory')
+def session_memory_stats():
+    """API endpoint to get the memory footprint of face processing sessions"""
+    return jsonify(session_manager.memory_stats())
+
+@app.route('/api/sessions/locks')
+def session_lock_stats():
+    """API endpoint to get session store lock hold times"""
+    return jsonify(session_manager.lock_stats())
+
+@app.route('/api/cache/reference')
+def reference_cache_stats():
+    """API endpoint to get hit/miss counters of the reference data caches"""
+    return jsonify(storage_service.reference_cache_stats())
+
+@app.route('/api/face_queue')
+def face_queue_stats():
+    """API endpoint to get face processing queue statistics"""
+    return jsonify(face_job_queue.stats())
 
 @app.route('/capture')
 def capture():
@@ -659,24 +897,27 @@ def assign_subjects(faculty_id):
             storage_service.update_faculty(faculty_id, {'subjects': selected_subjects})
             
             # Update subject documents to add/remove this faculty_id
+            loader = entity_loader()
+            loader.prime('subjects', previous_subjects)
+            loader.prime('subjects', selected_subjects)
             for subject_id in previous_subjects:
                 if subject_id not in selected_subjects:
                     # Remove faculty from this subject
-                    subject = storage_service.get_subject_by_id(subject_id)
-                    if subject and hasattr(subject, 'faculty_ids') and faculty_id in subject.faculty_ids:
-                        subject.faculty_ids.remove(faculty_id)
-                        storage_service.update_subject(subject_id, {'faculty_ids': subject.faculty_ids})
+                    subject = loader.load('subjects', subject_id)
+                    faculty_ids = getattr(subject, 'faculty_ids', None) or []
+                    if subject and faculty_id in faculty_ids:
+                        # Cached subjects are shared; write a new list rather than editing theirs
+                        faculty_ids = [other_id for other_id in faculty_ids if other_id != faculty_id]
+                        storage_service.update_subject(subject_id, {'faculty_ids': faculty_ids})
             
             for subject_id in selected_subjects:
                 if subject_id not in previous_subjects:
                     # Add faculty to this subject
-                    subject = storage_service.get_subject_by_id(subject_id)
+                    subject = loader.load('subjects', subject_id)
                     if subject:
-                        if not hasattr(subject, 'faculty_ids'):
-                            subject.faculty_ids = []
-                        if faculty_id not in subject.faculty_ids:
-                            subject.faculty_ids.append(faculty_id)
-                            storage_service.update_subject(subject_id, {'faculty_ids': subject.faculty_ids})
+                        faculty_ids = getattr(subject, 'faculty_ids', None) or []
+                        if faculty_id not in faculty_ids:
+                            storage_service.update_subject(subject_id, {'faculty_ids': faculty_ids + [faculty_id]})
             
             flash('Subjects assigned successfully', 'success')
             return redirect(url_for('admin_faculty'))
@@ -692,7 +933,7 @@ def assign_subjects(faculty_id):
         department_name = "Unknown"
         if isinstance(faculty.departments, str):
             dept_id = faculty.departments
-            dept = next((d for d in storage_service.get_all_departments() if d.dept_id == dept_id), None)
+            dept = storage_service.get_department_by_id(dept_id)
             if dept:
                 department_name = dept.name
         
@@ -745,8 +986,8 @@ def remove_subject(subject_id):
             faculty_list = storage_service.get_all_faculty()
             for faculty in faculty_list:
                 if hasattr(faculty, 'subjects') and subject_id in faculty.subjects:
-                    faculty.subjects.remove(subject_id)
-                    storage_service.update_faculty(faculty.faculty_id, {'subjects': faculty.subjects})
+                    subjects = [other_id for other_id in faculty.subjects if other_id != subject_id]
+                    storage_service.update_faculty(faculty.faculty_id, {'subjects': subjects})
             
             flash('Subject removed successfully', 'success')
         else:
@@ -791,16 +1032,21 @@ def admin_enroll_student():
     subjects = storage_service.get_all_subjects()
     departments = storage_service.get_all_departments()
     
-    # Get all subjects with their enrolled students
+    # Get all subjects with their enrolled students, from one read of the
+    # enrollments and the students loaded above
+    student_names = {student.student_id: student.name for student in students}
+    enrolled_by_subject = {}
+    for student_id, subject_id in storage_service.get_all_enrollments():
+        enrolled_by_subject.setdefault(subject_id, []).append(student_id)
+    
     subjects_with_enrollments = []
     for subject in subjects:
         # Get the list of student names for display
-        enrolled_student_names = []
-        enrolled_student_ids = storage_service.get_enrolled_students(subject.subject_id)
-        for student_id in enrolled_student_ids or []:
-            student = storage_service.get_student(student_id)
-            if student:
-                enrolled_student_names.append(student.name)
+        enrolled_student_names = [
+            student_names[student_id]
+            for student_id in enrolled_by_subject.get(subject.subject_id, [])
+            if student_id in student_names
+        ]
         
         subjects_with_enrollments.append({
             'subject': subject,
@@ -841,6 +1087,96 @@ def get_subjects():
         app.logger.error(f"Error fetching subjects: {e}")
         return jsonify({'error': 'Failed to fetch subjects'}), 500
 
+EXPORT_COLUMNS = ['attendance_id', 'student_id', 'subject_id', 'class_date', 'date', 'status', 'verified_by']
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_CHUNK_SIZE = 64 * 1024  # Bytes of rows buffered before each write to the client
+
+def export_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+@app.route('/api/attendance/export')
+def export_attendance():
+    """
+    API endpoint streaming attendance records as CSV or NDJSON
+    
+    Query parameters: format (csv or ndjson), subject_id, department_id,
+    student_id, start_date, end_date (inclusive class dates, YYYY-MM-DD).
+    Records are read page by page and written as they arrive, so exports
+    of any size use constant memory.
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"Unsupported format {export_format}, use csv or ndjson"}), 400
+    
+    filters = {}
+    for key in ('subject_id', 'student_id'):
+        if request.args.get(key):
+            filters[key] = request.args[key]
+    
+    # Date bounds are inclusive class dates, so end_date covers that whole day
+    for key, filter_key in (('start_date', 'from_class_date'), ('end_date', 'to_class_date')):
+        if request.args.get(key):
+            try:
+                filters[filter_key] = date.fromisoformat(request.args[key]).isoformat()
+            except ValueError:
+                return jsonify({'error': f"Invalid {key} {request.args[key]}, use YYYY-MM-DD"}), 400
+    
+    department_id = request.args.get('department_id')
+    if department_id:
+        # Departments are not on attendance rows; export the department's subjects
+        subject_ids = [subject.subject_id for subject in storage_service.get_all_subjects() if subject.department_id == department_id]
+        if 'subject_id' in filters:
+            subject_ids = [subject_id for subject_id in subject_ids if subject_id == filters['subject_id']]
+        filters['subject_ids'] = subject_ids
+    
+    # Read the first page before responding, so a failing query is an error response rather than an empty file
+    records = iter(())
+    first_record = None
+    if filters.get('subject_ids') != []:
+        try:
+            records = storage_service.iter_attendance_records(filters, columns=EXPORT_COLUMNS)
+            first_record = next(records, None)
+        except Exception as e:
+            logger.error(f"Attendance export failed: {e}")
+            return jsonify({'error': 'Could not read attendance records'}), 500
+    
+    def rows():
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        if export_format == 'csv':
+            writer.writerow(EXPORT_COLUMNS)
+        if first_record is None:
+            if buffer.tell():
+                yield buffer.getvalue()
+            return
+        
+        try:
+            for record in itertools.chain([first_record], records):
+                values = [export_value(getattr(record, column)) for column in EXPORT_COLUMNS]
+                if export_format == 'csv':
+                    writer.writerow(values)
+                else:
+                    buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, values))) + "\n")
+                
+                if buffer.tell() >= EXPORT_CHUNK_SIZE:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        except Exception as e:
+            # Headers are already sent; cutting the stream short is the only way to signal failure
+            logger.error(f"Attendance export failed: {e}")
+            raise
+        
+        if buffer.tell():
+            yield buffer.getvalue()
+    
+    filename = f"attendance-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{export_format}"
+    return Response(stream_with_context(rows()), mimetype=EXPORT_FORMATS[export_format], headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/admin/bulk_enroll_student', methods=['GET', 'POST'])
 def admin_bulk_enroll_student():
     """Route to handle bulk enrollment of students in semester courses"""
@@ -941,18 +1277,16 @@ def get_faculty_subjects(faculty_id):
         
         subject_ids = getattr(faculty, 'subjects', [])
         
-        # Get subject details for each subject ID
+        # Get subject details for all subject IDs at once
         subjects = []
-        for subject_id in subject_ids:
-            subject = storage_service.get_subject_by_id(subject_id)
-            if subject:
-                subject_data = {
-                    'subject_id': subject_id,
-                    'name': subject.name,
-                    'department_id': getattr(subject, 'department_id', ''),
-                    'semester': getattr(subject, 'semester', 1)
-                }
-                subjects.append(subject_data)
+        for subject in entity_loader().subjects(subject_ids):
+            subject_data = {
+                'subject_id': subject.subject_id,
+                'name': subject.name,
+                'department_id': getattr(subject, 'department_id', ''),
+                'semester': getattr(subject, 'semester', 1)
+            }
+            subjects.append(subject_data)
         
         return jsonify({
             'success': True,
@@ -974,23 +1308,21 @@ def student_view_attendance(student_id):
         return "Student not found", 404
     
     # Get all subjects the student is enrolled in
-    enrolled_subject_ids = storage_service.get_student_enrolled_subjects(student_id)
+    enrolled_subjects = storage_service.get_student_subjects(student_id)
     
     # Get attendance for each subject
     attendance_data = []
-    for subject_id in enrolled_subject_ids:
-        subject = storage_service.get_subject_by_id(subject_id)
-        if subject:
-            summary = attendance_service.get_student_attendance_summary(student_id, subject_id)
-            
-            attendance_data.append({
-                'subject_id': subject_id,
-                'subject_name': subject.name,
-                'subject_code': getattr(subject, 'code', subject_id),
-                'days_present': summary['present_count'],
-                'total_days': summary['total_classes'],
-                'percentage': summary['attendance_percentage']
-            })
+    for subject in enrolled_subjects:
+        summary = attendance_service.get_student_attendance_summary(student_id, subject.subject_id)
+        
+        attendance_data.append({
+            'subject_id': subject.subject_id,
+            'subject_name': subject.name,
+            'subject_code': getattr(subject, 'code', subject.subject_id),
+            'days_present': summary['present_count'],
+            'total_days': summary['total_classes'],
+            'percentage': summary['attendance_percentage']
+        })
     
     return render_template('student/view_attendance.html', 
                          student=student,
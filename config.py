@@ -16,6 +16,30 @@ class Config:
     FACE_THRESHOLD = 0.25
     FACE_ENCODING_DIMENSION = 128
     FACE_METRIC = "euclidean"
+    FACE_MATCH_BACKEND = os.getenv("FACE_MATCH_BACKEND", "pinecone")  # "pinecone" or "local"
+    FACE_MATCH_SCOPE = os.getenv("FACE_MATCH_SCOPE", "subject")  # "subject" (enrolled roster only) or "all"
+    VECTOR_QUERY_CONCURRENCY = 8  # Max concurrent Pinecone queries per batch match
+    SUBJECT_GALLERY_CACHE_SIZE = 256  # Subject roster galleries kept for the local backend
+    FACE_GALLERY_MAX_AGE = int(os.getenv("FACE_GALLERY_MAX_AGE", 300))  # Seconds before the local gallery is reloaded from Pinecone (0 disables)
+    
+    # Face Detection Settings
+    FACE_DETECTION_DOWNSCALE = os.getenv("FACE_DETECTION_DOWNSCALE", "true").lower() == "true"
+    FACE_MIN_SIZE_RATIO = 0.03  # Smallest expected face, as a fraction of the image's shorter side
+    FACE_DETECTOR_MIN_SIZE = 40  # Smallest face (px) the HOG detector finds with one upsample
+    
+    # Annotated Image Settings
+    ANNOTATED_MAX_DIMENSION = int(os.getenv("ANNOTATED_MAX_DIMENSION", 1600))  # Longest side (px) of the annotated image
+    ANNOTATED_FORMAT = os.getenv("ANNOTATED_FORMAT", "webp").lower()  # "webp" or "jpeg" (progressive)
+    if ANNOTATED_FORMAT not in ("webp", "jpeg"):
+        ANNOTATED_FORMAT = "jpeg"
+    ANNOTATED_QUALITY = int(os.getenv("ANNOTATED_QUALITY", 75))
+    
+    # Face Processing Workers
+    FACE_WORKERS = int(os.getenv("FACE_WORKERS", os.cpu_count() or 1))  # Processes running dlib
+    FACE_WORKER_START_METHOD = os.getenv("FACE_WORKER_START_METHOD", "fork")
+    FACE_SESSION_THREADS = int(os.getenv("FACE_SESSION_THREADS", FACE_WORKERS * 2))  # Threads driving sessions (matching, DB writes)
+    FACE_QUEUE_MAX_DEPTH = int(os.getenv("FACE_QUEUE_MAX_DEPTH", 50))  # Waiting sessions before uploads are rejected
+    FACE_JOB_ESTIMATE = 10  # Initial guess (seconds) of one session's processing time
     
     # Pinecone Configuration
     PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
@@ -27,11 +51,29 @@ class Config:
     SUPABASE_URL = os.getenv('SUPABASE_URL')
     SUPABASE_KEY = os.getenv('SUPABASE_KEY')
     SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_KEY')
+    SUPABASE_IN_FILTER_BATCH_SIZE = 200  # IDs per "in" filter, keeping request URLs short
+    SUPABASE_PAGE_SIZE = 1000  # Rows per request when reading a whole table (the API's max_rows)
+    ATTENDANCE_INSERT_BATCH_SIZE = 500  # Attendance rows per insert request
+    ATTENDANCE_SUMMARY_MAX_AGE = 600  # Seconds before attendance counters are rebuilt from the database
+    ATTENDANCE_SUMMARY_WINDOW = 5000  # Most recent classes whose per-student statuses are kept for deduplication
+    REFERENCE_CACHE_TTL = int(os.getenv("REFERENCE_CACHE_TTL", 300))  # Seconds departments, subjects and faculty are cached
+    REFERENCE_CACHE_MAX_ENTRIES = 10000  # Most rows cached per table
+    ENROLLMENT_RECONCILE_INTERVAL = 300  # Seconds between reloads of the enrollment index from the database
     
     # Session Management
-    SESSION_CLEANUP_INTERVAL = 300  # 5 minutes
+    SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # "memory" (single process) or "sqlite" (shared by worker processes)
+    SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+    SESSION_DB_TIMEOUT = 5  # Seconds to wait for a locked SQLite database
+    SESSION_DB_POLL_INTERVAL = 0.1  # Seconds between version checks while waiting for updates
+    SESSION_TOUCH_INTERVAL = 30  # Seconds between last-access writes made by reads of a session
+    SESSION_CLEANUP_INTERVAL = 5  # Longest the cleanup thread sleeps between expiry checks
     SESSION_PENDING_TTL = 900  # 15 minutes
+    SESSION_COMPLETED_TTL = 1800  # Completed sessions expire 30 minutes after last access
+    SESSION_ERROR_TTL = 300  # Errored sessions expire 5 minutes after last access
     SESSION_MAX_VIEWS = 3
+    SESSION_LOCK_STRIPES = 64  # Locks sessions are spread over; unrelated sessions rarely share one
+    SESSION_MEMORY_BUDGET = int(os.getenv("SESSION_MEMORY_BUDGET", 256 * 1024 * 1024))  # Bytes held across all sessions
+    SESSION_STREAM_HEARTBEAT = 15  # Seconds between keep-alive comments on progress streams
     
     # Server Settings
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
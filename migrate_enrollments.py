@@ -0,0 +1,63 @@
+"""
+Copy enrollments from the legacy JSON arrays into the enrollments table
+
+Reads subjects.enrolled_students and students.course_enrolled_ids, keeps the
+pairs whose student and subject both exist, and inserts them in batches.
+Enrollments already in the table are left alone, so the tool can be re-run.
+
+Usage:
+    python migrate_enrollments.py [--dry-run]
+"""
+import argparse
+import logging
+
+from models.student import Student
+from models.subject import Subject
+from services.supabase_adapter import SupabaseAdapter
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500  # Enrollment rows per insert request
+
+def collect_enrollments(students, subjects):
+    """Union the (student_id, subject_id) pairs of both legacy arrays"""
+    student_ids = {student.student_id for student in students}
+    subject_ids = {subject.subject_id for subject in subjects}
+
+    pairs = set()
+    for subject in subjects:
+        pairs.update((student_id, subject.subject_id) for student_id in subject.enrolled_students or [])
+    for student in students:
+        pairs.update((student.student_id, subject_id) for subject_id in student.course_enrolled_ids or [])
+
+    valid = {pair for pair in pairs if pair[0] in student_ids and pair[1] in subject_ids}
+    if len(valid) < len(pairs):
+        logger.warning(f"Skipping {len(pairs) - len(valid)} enrollments of unknown students or subjects")
+    return sorted(valid)
+
+def load_all(db, table, key, model):
+    """Read every row of a table a page at a time; errors are raised, not swallowed"""
+    records = db._select_pages(lambda: db.supabase.table(table).select("*").order(key))
+    return [model.from_dict(record) for record in records]
+
+def migrate(dry_run=False):
+    db = SupabaseAdapter()
+    students = load_all(db, 'students', 'student_id', Student)
+    subjects = load_all(db, 'subjects', 'subject_id', Subject)
+    logger.info(f"Read {len(students)} students and {len(subjects)} subjects")
+    pairs = collect_enrollments(students, subjects)
+    logger.info(f"Found {len(pairs)} enrollments in the legacy arrays")
+    if dry_run:
+        return
+
+    for start in range(0, len(pairs), BATCH_SIZE):
+        rows = [{'student_id': student_id, 'subject_id': subject_id} for student_id, subject_id in pairs[start:start + BATCH_SIZE]]
+        db.supabase.table('enrollments').upsert(rows, on_conflict='student_id,subject_id', ignore_duplicates=True).execute()
+        logger.info(f"Copied {min(start + BATCH_SIZE, len(pairs))}/{len(pairs)} enrollments")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help="Only count the enrollments to copy")
+    args = parser.parse_args()
+    migrate(dry_run=args.dry_run)
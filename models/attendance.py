@@ -6,14 +6,20 @@ class Attendance:
     """
     Represents student attendance for a subject
     """
+    # Statuses from weakest to strongest; a stronger status replaces a weaker
+    # one recorded for the same class (present wins over absent)
+    STATUS_PRECEDENCE = ('absent', 'late', 'present')
+    
     def __init__(self, attendance_id, student_id, subject_id, 
-                 date=None, status="present", verified_by=None):
+                 date=None, status="present", verified_by=None, class_date=None):
         self.attendance_id = attendance_id  # Unique attendance ID
         self.student_id = student_id        # Student ID
         self.subject_id = subject_id        # Subject ID
         self.date = date                    # Date of attendance (will use Firestore SERVER_TIMESTAMP)
         self.status = status                # Status: present, absent, late
         self.verified_by = verified_by      # Faculty ID who verified
+        # Class date; with student and subject it identifies one attendance record
+        self.class_date = class_date or (date.date() if isinstance(date, datetime) else None)
         self.timestamp = datetime.now()     # Timestamp of record
     
     @staticmethod
@@ -25,7 +31,8 @@ class Attendance:
             subject_id=source.get('subject_id'),
             date=source.get('date'),
             status=source.get('status', 'present'),
-            verified_by=source.get('verified_by')
+            verified_by=source.get('verified_by'),
+            class_date=source.get('class_date')
         )
         if source.get('timestamp'):
             attendance.timestamp = source.get('timestamp')
@@ -43,5 +50,6 @@ class Attendance:
             'date': date_field,
             'status': self.status,
             'verified_by': self.verified_by,
+            'class_date': self.class_date.isoformat() if hasattr(self.class_date, 'isoformat') else self.class_date,
             'timestamp': self.timestamp
         }
\ No newline at end of file
@@ -12,7 +12,7 @@ class Student:
         self.department_id = department_id  # Primary department ID
         self.batch_year = batch_year        # Year of admission
         self.current_semester = current_semester  # Current semester
-        self.course_enrolled_ids = course_enrolled_ids or []
+        self.course_enrolled_ids = course_enrolled_ids or []  # Legacy; enrollments now live in the enrollments table
         self.enrollment_date = enrollment_date or datetime.now()  # Date of enrollment
     
     @staticmethod
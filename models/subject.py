@@ -12,7 +12,7 @@ class Subject:
         self.is_elective = is_elective    # Whether the subject is an elective
         self.semester = semester          # Semester the subject is taught in
         self.enrolled_students = enrolled_students or []
-        # List of students enrolled in the subject
+        # Legacy list of enrolled students; enrollments now live in the enrollments table
     
     @staticmethod
     def from_dict(source):
@@ -34,78 +34,128 @@ class AttendanceService:
             logger.error(f"Error marking attendance: {e}")
             return False
     
+    def mark_attendance_bulk(self, student_statuses, subject_id, faculty_id=None):
+        """
+        Mark attendance for many students of one class at once
+        
+        Args:
+            student_statuses: Dictionary mapping student ID to status
+            subject_id: Subject the attendance is for
+            faculty_id: Faculty ID who verified the attendance
+        
+        Returns:
+            Number of attendance records stored
+        """
+        try:
+            date = datetime.now()
+            attendance_records = [
+                Attendance(
+                    attendance_id=f"att_{uuid.uuid4().hex}",
+                    student_id=student_id,
+                    subject_id=subject_id,
+                    date=date,
+                    status=status,
+                    verified_by=faculty_id
+                )
+                for student_id, status in student_statuses.items()
+            ]
+            
+            return self.storage.record_attendance_bulk(attendance_records)
+        
+        except Exception as e:
+            logger.error(f"Error marking attendance in bulk: {e}")
+            return 0
+    
+    @staticmethod
+    def _attendance_percentage(counts):
+        """Share of classes attended (present or late), as a percentage"""
+        attended = counts['present_count'] + counts['late_count']
+        total = counts['total_classes']
+        return round(attended / total * 100, 2) if total > 0 else 0
+    
+    @staticmethod
+    def _empty_counts():
+        """Zeroed counts, returned alongside an error so callers can still render"""
+        return {
+            'total_classes': 0,
+            'present_count': 0,
+            'absent_count': 0,
+            'late_count': 0,
+            'attendance_percentage': 0
+        }
+    
+    def get_all_student_summaries(self, subject_id=None, start_date=None, end_date=None):
+        """
+        Get attendance summaries for all students
+        
+        Reads the maintained counters; a date range is aggregated by the
+        database in one query instead.
+        
+        Returns:
+            Tuple of (dictionary of student ID -> summary, number of class days).
+            Students without attendance records are not included; both are
+            empty if the counts cannot be read.
+        """
+        try:
+            if start_date or end_date:
+                aggregated = self.storage.get_attendance_summaries(subject_id, start_date, end_date)
+                all_counts, total_days = aggregated['students'], aggregated['total_days']
+            else:
+                all_counts, total_days = self.storage.attendance_summaries.all_student_counts(subject_id)
+        except Exception as e:
+            logger.error(f"Error getting attendance summaries: {e}")
+            return {}, 0
+        
+        summaries = {
+            student_id: {
+                'student_id': student_id,
+                **counts,
+                'attendance_percentage': self._attendance_percentage(counts)
+            }
+            for student_id, counts in all_counts.items()
+        }
+        return summaries, total_days
+    
     def get_student_attendance_summary(self, student_id, subject_id=None):
         """Get attendance summary for a student"""
         try:
-            attendance_records = self.storage.get_student_attendance(student_id, subject_id)
-            
-            if not attendance_records:
-                return {
-                    'student_id': student_id,
-                    'total_classes': 0,
-                    'present_count': 0,
-                    'absent_count': 0,
-                    'late_count': 0,
-                    'attendance_percentage': 0
-                }
-            
-            present_count = sum(1 for rec in attendance_records if rec.status == 'present')
-            absent_count = sum(1 for rec in attendance_records if rec.status == 'absent')
-            late_count = sum(1 for rec in attendance_records if rec.status == 'late')
-            total_classes = len(attendance_records)
-            
-            attendance_percentage = (present_count + late_count) / total_classes * 100 if total_classes > 0 else 0
-            
+            counts = self.storage.attendance_summaries.student_counts(student_id, subject_id)
             return {
                 'student_id': student_id,
-                'total_classes': total_classes,
-                'present_count': present_count,
-                'absent_count': absent_count,
-                'late_count': late_count,
-                'attendance_percentage': round(attendance_percentage, 2)
+                'total_classes': counts['total_classes'],
+                'present_count': counts['present_count'],
+                'absent_count': counts['absent_count'],
+                'late_count': counts['late_count'],
+                'attendance_percentage': self._attendance_percentage(counts)
             }
         except Exception as e:
             logger.error(f"Error getting student attendance summary: {e}")
             return {
                 'student_id': student_id,
+                **self._empty_counts(),
                 'error': str(e)
             }
     
     def get_subject_attendance_summary(self, subject_id, date=None):
         """Get attendance summary for a subject"""
         try:
-            attendance_records = self.storage.get_subject_attendance(subject_id, date)
-            
-            if not attendance_records:
-                return {
-                    'subject_id': subject_id,
-                    'date': date,
-                    'total_students': 0,
-                    'present_count': 0,
-                    'absent_count': 0,
-                    'late_count': 0,
-                    'attendance_percentage': 0
-                }
-            
-            present_count = sum(1 for rec in attendance_records if rec.status == 'present')
-            absent_count = sum(1 for rec in attendance_records if rec.status == 'absent')
-            late_count = sum(1 for rec in attendance_records if rec.status == 'late')
-            total_students = len(attendance_records)
-            
-            attendance_percentage = (present_count + late_count) / total_students * 100 if total_students > 0 else 0
-            
+            counts = self.storage.attendance_summaries.subject_counts(subject_id, date)
             return {
                 'subject_id': subject_id,
                 'date': date,
-                'total_students': total_students,
-                'present_count': present_count,
-                'absent_count': absent_count,
-                'late_count': late_count,
-                'attendance_percentage': round(attendance_percentage, 2)
+                'total_students': counts['total_classes'],
+                'present_count': counts['present_count'],
+                'absent_count': counts['absent_count'],
+                'late_count': counts['late_count'],
+                'attendance_percentage': self._attendance_percentage(counts)
             }
         except Exception as e:
             logger.error(f"Error getting subject attendance summary: {e}")
+            counts = self._empty_counts()
             return {
                 'subject_id': subject_id,
+                'date': date,
+                'total_students': counts.pop('total_classes'),
+                **counts,
                 'error': str(e)
             }
\ No newline at end of file
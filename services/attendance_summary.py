@@ -0,0 +1,246 @@
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+from config import config
+from models.attendance import Attendance
+
+logger = logging.getLogger(__name__)
+
+def class_date_key(value):
+    """Normalize a class date (date, datetime or ISO string) to 'YYYY-MM-DD'"""
+    if isinstance(value, datetime):
+        value = value.date()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)[:10] if value else None
+
+class _Counters:
+    """Status counters built from one load of the attendance table"""
+
+    def __init__(self, window_size):
+        self.window_size = window_size
+        self.window = OrderedDict()  # (subject_id, class_date) -> {student_id: status}, most recent classes only
+        self.student_subject = {}  # (student_id, subject_id) -> Counter
+        self.student_totals = {}  # student_id -> Counter
+        self.subject_date = {}  # (subject_id, class_date) -> Counter
+        self.subject_totals = {}  # subject_id -> Counter
+        self.class_dates = Counter()  # class_date -> number of records
+
+    def apply(self, attendance):
+        """
+        Fold one attendance record into the counters
+
+        Returns:
+            False if the record's class has left the window, so whether it
+            replaces an earlier record cannot be told
+        """
+        class_date = class_date_key(attendance.class_date or attendance.date)
+        class_key = (attendance.subject_id, class_date)
+        statuses = self.window.get(class_key)
+        if statuses is None:
+            counter = self.subject_date.get(class_key)
+            if counter and counter['total'] > 0:
+                return False
+            statuses = self.window[class_key] = {}
+            while len(self.window) > self.window_size:
+                self.window.popitem(last=False)
+        else:
+            self.window.move_to_end(class_key)
+
+        previous = statuses.get(attendance.student_id)
+        if previous is not None:
+            if self._rank(attendance.status) <= self._rank(previous):
+                return True
+            self._count(attendance.student_id, class_key, previous, -1)
+        statuses[attendance.student_id] = attendance.status
+        self._count(attendance.student_id, class_key, attendance.status, 1)
+        return True
+
+    @staticmethod
+    def _rank(status):
+        if status in Attendance.STATUS_PRECEDENCE:
+            return Attendance.STATUS_PRECEDENCE.index(status)
+        return -1
+
+    def _count(self, student_id, class_key, status, delta):
+        subject_id, class_date = class_key
+        for counters, counter_key in (
+            (self.student_subject, (student_id, subject_id)),
+            (self.student_totals, student_id),
+            (self.subject_date, class_key),
+            (self.subject_totals, subject_id)
+        ):
+            counter = counters.setdefault(counter_key, Counter())
+            counter[status] += delta
+            counter['total'] += delta
+
+        self.class_dates[class_date] += delta
+        if self.class_dates[class_date] <= 0:
+            del self.class_dates[class_date]
+
+class AttendanceSummaryStore:
+    """
+    Attendance counters maintained incrementally as attendance is written
+
+    Keeps status counts per (student, subject), per student, per
+    (subject, class date) and per subject, so summaries are dictionary
+    lookups instead of scans over attendance rows. The database stays the
+    system of record: the store is built from it on first use, rebuilt in
+    the background when older than max_age (to pick up writes made by other
+    processes) and updated in place by writes made through this process.
+    Readers keep getting the previous counters while a rebuild runs.
+
+    Writes follow the database's upsert rules: one record per student,
+    subject and class date, and a stronger status replaces a weaker one.
+    Statuses are only remembered for the window_size most recent classes;
+    a write to an older class marks the counters stale instead.
+    """
+
+    RETRY_DELAY = 30  # Seconds before a failed background rebuild is retried
+
+    def __init__(self, loader, max_age=None, window_size=None):
+        """
+        Args:
+            loader: Callable returning an iterable of every attendance record
+            max_age: Seconds before the counters are rebuilt from the database
+            window_size: Most recent classes whose statuses are remembered
+        """
+        self.loader = loader
+        self.max_age = max_age if max_age is not None else config.ATTENDANCE_SUMMARY_MAX_AGE
+        self.window_size = window_size or config.ATTENDANCE_SUMMARY_WINDOW
+        self.lock = threading.Lock()  # Guards the counters; never held across a database read
+        self.build_lock = threading.Lock()  # One rebuild at a time
+        self.counters = None
+        self.refresh_at = None  # Monotonic time of the next background rebuild
+        self.stale = False
+        self.pending = None  # Records written while a rebuild runs, replayed onto its result
+
+    def rebuild(self):
+        """Recompute every counter from the attendance records in the database"""
+        with self.build_lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        started = time.monotonic()
+        with self.lock:
+            self.pending = []
+            self.stale = False
+
+        counters = _Counters(self.window_size)
+        count = 0
+        try:
+            for attendance in self.loader():
+                counters.apply(attendance)
+                count += 1
+        except Exception:
+            with self.lock:
+                self.pending = None
+                self.stale = True
+                self.refresh_at = time.monotonic() + self.RETRY_DELAY
+            raise
+
+        with self.lock:
+            for attendance in self.pending:
+                if not counters.apply(attendance):
+                    self.stale = True
+            self.pending = None
+            self.refresh_at = started + self.max_age
+            self.counters = counters
+        logger.info(f"Built attendance summaries from {count} records")
+
+    def _refresh(self):
+        try:
+            self._rebuild()
+        except Exception as e:
+            logger.error(f"Error rebuilding attendance summaries, serving the previous counters: {e}")
+        finally:
+            self.build_lock.release()
+
+    def invalidate(self):
+        """Rebuild on the next read"""
+        with self.lock:
+            self.stale = True
+
+    def _current(self):
+        """Get the counters to read, building them or starting a background rebuild as needed"""
+        if self.counters is None:
+            with self.build_lock:
+                if self.counters is None:
+                    self._rebuild()
+        elif self.stale or time.monotonic() >= self.refresh_at:
+            if self.build_lock.acquire(blocking=False):
+                try:
+                    threading.Thread(target=self._refresh, name="attendance-summary-rebuild", daemon=True).start()
+                except Exception:
+                    self.build_lock.release()
+                    raise
+        return self.counters
+
+    def apply(self, records):
+        """Fold newly written attendance records into the counters"""
+        with self.lock:
+            if self.counters is None:
+                return  # Not built yet; the first read loads these from the database
+            for attendance in records:
+                if not self.counters.apply(attendance):
+                    self.stale = True
+            if self.pending is not None:
+                self.pending.extend(records)
+
+    @staticmethod
+    def _counts(counter):
+        counter = counter or Counter()
+        return {
+            'present_count': counter['present'],
+            'absent_count': counter['absent'],
+            'late_count': counter['late'],
+            'total_classes': counter['total']
+        }
+
+    def student_counts(self, student_id, subject_id=None):
+        """Get a student's status counts, overall or in one subject"""
+        self._current()
+        with self.lock:
+            if subject_id:
+                return self._counts(self.counters.student_subject.get((student_id, subject_id)))
+            return self._counts(self.counters.student_totals.get(student_id))
+
+    def subject_counts(self, subject_id, class_date=None):
+        """Get a subject's status counts, overall or for one class date"""
+        self._current()
+        with self.lock:
+            if class_date:
+                return self._counts(self.counters.subject_date.get((subject_id, class_date_key(class_date))))
+            return self._counts(self.counters.subject_totals.get(subject_id))
+
+    def all_student_counts(self, subject_id=None):
+        """
+        Get status counts for every student with attendance
+
+        Returns:
+            Tuple of (dictionary of student ID -> counts, number of class days)
+        """
+        self._current()
+        with self.lock:
+            counters = self.counters
+            if subject_id is None:
+                students = {
+                    student_id: self._counts(counter)
+                    for student_id, counter in counters.student_totals.items()
+                    if counter['total'] > 0
+                }
+                return students, len(counters.class_dates)
+
+            students = {
+                student_id: self._counts(counter)
+                for (student_id, counter_subject_id), counter in counters.student_subject.items()
+                if counter_subject_id == subject_id and counter['total'] > 0
+            }
+            total_days = sum(
+                1 for (counter_subject_id, _), counter in counters.subject_date.items()
+                if counter_subject_id == subject_id and counter['total'] > 0
+            )
+            return students, total_days
@@ -1,8 +1,10 @@
 # services/database_interface.py
 from abc import ABC, abstractmethod
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator, Tuple
 from datetime import datetime
 
+from services.attendance_summary import class_date_key
+
 class DatabaseInterface(ABC):
     """Abstract interface for database operations"""
     
@@ -11,6 +13,11 @@ class DatabaseInterface(ABC):
         """Get a student by ID"""
         pass
     
+    @abstractmethod
+    def get_students_by_ids(self, student_ids: List[str]) -> List:
+        """Get the students among a list of IDs in one query"""
+        pass
+    
     @abstractmethod
     def get_all_students(self) -> List:
         """Get all students"""
@@ -56,6 +63,11 @@ class DatabaseInterface(ABC):
         """Get faculty by ID"""
         pass
     
+    @abstractmethod
+    def get_faculty_by_ids(self, faculty_ids: List[str]) -> List:
+        """Get the faculty members among a list of IDs in one query"""
+        pass
+    
     @abstractmethod
     def add_faculty(self, faculty) -> bool:
         """Add a new faculty member"""
@@ -81,6 +93,11 @@ class DatabaseInterface(ABC):
         """Get subject by ID"""
         pass
     
+    @abstractmethod
+    def get_subjects_by_ids(self, subject_ids: List[str]) -> List:
+        """Get the subjects among a list of IDs in one query"""
+        pass
+    
     @abstractmethod
     def add_subject(self, subject) -> bool:
         """Add a new subject"""
@@ -102,8 +119,19 @@ class DatabaseInterface(ABC):
         pass
     
     @abstractmethod
-    def enroll_student_in_courses(self, student_id: str, course_ids: List[str]) -> bool:
-        """Enroll student in multiple courses"""
+    def enroll_student_in_courses(self, student_id: str, course_ids: List[str]) -> Optional[List[str]]:
+        """
+        Enroll student in multiple courses
+        
+        Returns:
+            IDs of the courses the student is enrolled in after the write
+            (courses that do not exist are skipped), or None if it failed
+        """
+        pass
+    
+    @abstractmethod
+    def unenroll_student_from_courses(self, student_id: str, course_ids: List[str]) -> bool:
+        """Remove a student from several courses"""
         pass
     
     @abstractmethod
@@ -121,6 +149,11 @@ class DatabaseInterface(ABC):
         """Get list of student IDs enrolled in a subject"""
         pass
     
+    @abstractmethod
+    def get_all_enrollments(self) -> List[Tuple[str, str]]:
+        """Get every enrollment as (student_id, subject_id) pairs"""
+        pass
+    
     @abstractmethod
     def update_student_semester(self, student_id: str, semester: int) -> bool:
         """Update student's current semester"""
@@ -131,7 +164,72 @@ class DatabaseInterface(ABC):
         """Get attendance records with optional filters"""
         pass
     
+    def iter_attendance_records(self, filters: Dict[str, Any] = None, page_size: int = None,
+                                columns: List[str] = None) -> Iterator:
+        """
+        Stream attendance records ordered by (date, attendance_id)
+        
+        Accepts the filters of get_attendance_records plus subject_ids (a list
+        of subjects to include) and from_class_date/to_class_date (inclusive
+        'YYYY-MM-DD' class date bounds). Adapters should override this to read
+        page by page; the default yields the records returned by
+        get_attendance_records.
+        """
+        filters = dict(filters or {})
+        subject_ids = filters.pop('subject_ids', None)
+        from_class_date = filters.pop('from_class_date', None)
+        to_class_date = filters.pop('to_class_date', None)
+        records = self.get_attendance_records(filters)
+        if subject_ids is not None:
+            subject_ids = set(subject_ids)
+            records = [record for record in records if record.subject_id in subject_ids]
+        if from_class_date or to_class_date:
+            records = [
+                record for record in records
+                if (not from_class_date or class_date_key(record.class_date or record.date) >= from_class_date)
+                and (not to_class_date or class_date_key(record.class_date or record.date) <= to_class_date)
+            ]
+        return iter(records)
+    
     @abstractmethod
     def add_attendance_record(self, attendance) -> bool:
-        """Add an attendance record"""
-        pass
\ No newline at end of file
+        """Add an attendance record, or merge it into the one stored for that class"""
+        pass
+    
+    @abstractmethod
+    def add_attendance_records(self, records: List) -> int:
+        """
+        Add several attendance records, returning how many were stored
+        
+        A record for a student, subject and class date that is already stored
+        is kept unless the new status takes precedence over it.
+        """
+        pass
+    
+    def get_attendance_summaries(self, filters: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Count attendance per student and status, and the distinct class dates
+        
+        Adapters that can aggregate in the database should override this; the
+        default counts the records returned by get_attendance_records.
+        
+        Returns:
+            Dictionary with 'students' (student ID -> present_count,
+            absent_count, late_count and total_classes) and 'total_days'
+        """
+        students = {}
+        class_dates = set()
+        for record in self.iter_attendance_records(filters, columns=['student_id', 'status', 'class_date']):
+            counts = students.setdefault(record.student_id, {
+                'present_count': 0,
+                'absent_count': 0,
+                'late_count': 0,
+                'total_classes': 0
+            })
+            status_key = f"{record.status}_count"
+            if status_key in counts:
+                counts[status_key] += 1
+            counts['total_classes'] += 1
+            class_dates.add(record.class_date or record.date)
+        
+        return {'students': students, 'total_days': len(class_dates)}
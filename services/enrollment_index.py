@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class EnrollmentIndex:
+    """
+    In-process index of enrollments in both directions
+
+    Maps subject -> student IDs and student -> subject IDs, so rosters are
+    dictionary lookups. The database stays the system of record: the index is
+    loaded on first use, updated in place by enrollment writes made through
+    this process, and reconciled against the database when older than
+    max_age to pick up writes made elsewhere. Readers keep the current index
+    while it reloads.
+
+    The sets are frozen and replaced on every change, so callers can hold on
+    to a roster while the index is updated.
+    """
+
+    def __init__(self, loader, max_age=None):
+        """
+        Args:
+            loader: Callable returning every enrollment as (student_id, subject_id) pairs
+            max_age: Seconds between reconciliations with the database
+        """
+        self.loader = loader
+        self.max_age = max_age if max_age is not None else config.ENROLLMENT_RECONCILE_INTERVAL
+        self.lock = threading.Lock()  # Guards the maps; never held across a database read
+        self.reload_lock = threading.Lock()  # One reload at a time
+        self.loaded_at = None
+        self.pending = None  # Writes made while a reload runs, replayed onto its result
+        self.by_subject = {}  # subject_id -> frozenset of student IDs
+        self.by_student = {}  # student_id -> frozenset of subject IDs
+
+    def reconcile(self):
+        """Reload the index from the database, logging any drift from it"""
+        with self.reload_lock:
+            self._reconcile()
+
+    def _reconcile(self):
+        # Load without the lock so roster reads keep being served; writes made
+        # meanwhile are journaled and replayed so the older snapshot does not undo them
+        with self.lock:
+            self.pending = []
+        try:
+            pairs = set(self.loader())
+        except Exception:
+            with self.lock:
+                self.pending = None
+            raise
+
+        by_subject = {}
+        by_student = {}
+        for student_id, subject_id in pairs:
+            by_subject.setdefault(subject_id, set()).add(student_id)
+            by_student.setdefault(student_id, set()).add(subject_id)
+
+        with self.lock:
+            pending, self.pending = self.pending, None
+            if self.loaded_at is not None:
+                current = set(self._all_pairs())
+                if current and not pairs:
+                    # The adapter returns nothing on errors; keep serving the index until the next attempt
+                    logger.warning("Enrollment reload returned nothing, keeping the current index")
+                    self.loaded_at = time.monotonic()
+                    return
+                if current != pairs:
+                    logger.info(
+                        f"Reconciled enrollment index: {len(pairs - current)} added, "
+                        f"{len(current - pairs)} removed elsewhere"
+                    )
+
+            self.by_subject = {subject_id: frozenset(ids) for subject_id, ids in by_subject.items()}
+            self.by_student = {student_id: frozenset(ids) for student_id, ids in by_student.items()}
+            for apply, student_id, subject_ids in pending:
+                apply(student_id, subject_ids)
+            self.loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self.loaded_at is None:
+            # Nothing to serve yet; wait for the first load
+            with self.reload_lock:
+                if self.loaded_at is None:
+                    self._reconcile()
+        elif time.monotonic() - self.loaded_at > self.max_age:
+            # Other readers keep the current index while this one reloads it
+            if self.reload_lock.acquire(blocking=False):
+                try:
+                    self._reconcile()
+                finally:
+                    self.reload_lock.release()
+
+    def invalidate(self):
+        """Force a reload on the next read"""
+        with self.lock:
+            self.loaded_at = None
+
+    def students_of(self, subject_id):
+        """Get the IDs of the students enrolled in a subject"""
+        self._ensure_fresh()
+        return self.by_subject.get(subject_id, frozenset())
+
+    def subjects_of(self, student_id):
+        """Get the IDs of the subjects a student is enrolled in"""
+        self._ensure_fresh()
+        return self.by_student.get(student_id, frozenset())
+
+    def all_pairs(self):
+        """Get every enrollment as (student_id, subject_id) pairs"""
+        self._ensure_fresh()
+        with self.lock:
+            return self._all_pairs()
+
+    def _all_pairs(self):
+        return [(student_id, subject_id) for subject_id, student_ids in self.by_subject.items() for student_id in student_ids]
+
+    def add(self, student_id, subject_ids):
+        """Record a student's new enrollments"""
+        with self.lock:
+            subject_ids = set(subject_ids)
+            if self.pending is not None:
+                self.pending.append((self._add, student_id, subject_ids))
+            if self.loaded_at is not None:
+                self._add(student_id, subject_ids)
+
+    def _add(self, student_id, subject_ids):
+        self.by_student[student_id] = self.by_student.get(student_id, frozenset()) | subject_ids
+        for subject_id in subject_ids:
+            self.by_subject[subject_id] = self.by_subject.get(subject_id, frozenset()) | {student_id}
+
+    def remove(self, student_id, subject_ids=None):
+        """Drop a student's enrollments in the given subjects, or in all of them"""
+        with self.lock:
+            subject_ids = None if subject_ids is None else set(subject_ids)
+            if self.pending is not None:
+                self.pending.append((self._remove, student_id, subject_ids))
+            if self.loaded_at is not None:
+                self._remove(student_id, subject_ids)
+
+    def _remove(self, student_id, subject_ids):
+        enrolled = self.by_student.get(student_id, frozenset())
+        subject_ids = enrolled if subject_ids is None else enrolled & subject_ids
+        remaining = enrolled - subject_ids
+        if remaining:
+            self.by_student[student_id] = remaining
+        else:
+            self.by_student.pop(student_id, None)
+        for subject_id in subject_ids:
+            students = self.by_subject.get(subject_id, frozenset()) - {student_id}
+            if students:
+                self.by_subject[subject_id] = students
+            else:
+                self.by_subject.pop(subject_id, None)
@@ -0,0 +1,64 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class EntityLoader:
+    """
+    Request-scoped batching loader for students, subjects and faculty
+
+    Ids are collected with prime() and fetched together on the first load,
+    and every entity loaded is remembered for the rest of the request, so a
+    page that resolves many ids costs one query per entity kind instead of
+    one per id. Create one per request; entities are not refreshed.
+    """
+
+    KINDS = ('students', 'subjects', 'faculty')
+
+    def __init__(self, storage):
+        self.fetchers = {
+            'students': (storage.get_students_by_ids, 'student_id'),
+            'subjects': (storage.get_subjects_by_ids, 'subject_id'),
+            'faculty': (storage.get_faculty_by_ids, 'faculty_id')
+        }
+        self.loaded = {kind: {} for kind in self.KINDS}  # kind -> id -> entity (None if missing)
+        self.pending = {kind: {} for kind in self.KINDS}  # kind -> ids to fetch on the next load (ordered set)
+
+    def prime(self, kind, ids):
+        """Queue ids to be fetched with the next load of this kind"""
+        loaded = self.loaded[kind]
+        self.pending[kind].update((entity_id, None) for entity_id in ids if entity_id and entity_id not in loaded)
+
+    def load_many(self, kind, ids):
+        """
+        Get several entities of one kind, fetching any not loaded yet in one query
+
+        Returns:
+            List of the entities that exist, in the order of ids
+        """
+        ids = list(ids)
+        self.prime(kind, ids)
+        pending = list(self.pending[kind])
+        if pending:
+            fetch, key = self.fetchers[kind]
+            self.pending[kind].clear()
+            loaded = self.loaded[kind]
+            loaded.update((entity_id, None) for entity_id in pending)
+            for entity in fetch(pending):
+                loaded[getattr(entity, key)] = entity
+
+        loaded = self.loaded[kind]
+        return [loaded[entity_id] for entity_id in ids if loaded.get(entity_id) is not None]
+
+    def load(self, kind, entity_id):
+        """Get one entity, or None if it does not exist"""
+        entities = self.load_many(kind, [entity_id])
+        return entities[0] if entities else None
+
+    def students(self, student_ids):
+        return self.load_many('students', student_ids)
+
+    def subjects(self, subject_ids):
+        return self.load_many('subjects', subject_ids)
+
+    def faculty(self, faculty_ids):
+        return self.load_many('faculty', faculty_ids)
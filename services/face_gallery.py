@@ -0,0 +1,256 @@
+import logging
+import threading
+import time
+import numpy as np
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class FaceGallery:
+    """
+    In-process face matching engine
+
+    Keeps student encodings in a contiguous float32 matrix with parallel
+    id/name arrays so a whole photo can be matched with one matrix product.
+    Pinecone stays the system of record; the gallery is loaded from it, kept
+    in sync on writes made through this process, and reloaded in the
+    background when older than max_age to pick up encodings written
+    elsewhere (other worker processes, other tooling).
+    """
+
+    RETRY_DELAY = 30  # Seconds before a failed background reload is retried
+
+    def __init__(self, dimension=None, max_age=None):
+        self.dimension = dimension or config.FACE_ENCODING_DIMENSION
+        self.max_age = max_age if max_age is not None else config.FACE_GALLERY_MAX_AGE
+        self.lock = threading.Lock()
+        self.reload_lock = threading.Lock()  # One reload from the index at a time
+        self.version = 0  # Bumped on every write so derived galleries can detect staleness
+        self.refresh_at = None  # Monotonic time of the next reload from the index; None if not loaded from one
+        self.pending = None  # Writes made while a reload runs, replayed onto its result
+        # (matrix, squared norms, ids, names) swapped as one tuple so readers never see a partial update
+        self._snapshot = self._build(
+            np.empty((0, self.dimension), dtype=np.float32),
+            np.empty(0, dtype=object),
+            np.empty(0, dtype=object)
+        )
+
+    @staticmethod
+    def _build(matrix, ids, names):
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        norms = np.einsum('ij,ij->i', matrix, matrix)
+        return matrix, norms, ids, names
+
+    def __len__(self):
+        return len(self._snapshot[2])
+
+    def load(self, entries):
+        """
+        Replace the gallery contents
+
+        Args:
+            entries: Iterable of (student_id, name, encoding) tuples
+        """
+        entries = list(entries)
+        matrix = np.empty((len(entries), self.dimension), dtype=np.float32)
+        ids = np.empty(len(entries), dtype=object)
+        names = np.empty(len(entries), dtype=object)
+        for i, (student_id, name, encoding) in enumerate(entries):
+            matrix[i] = encoding
+            ids[i] = student_id
+            names[i] = name
+
+        with self.lock:
+            self._snapshot = self._build(matrix, ids, names)
+            # Writes made while the entries were fetched are newer than them
+            for apply, args in self.pending or []:
+                apply(*args)
+            self.pending = None
+            self.version += 1
+        logger.info(f"Loaded {len(entries)} face encodings into the gallery")
+
+    def load_from_index(self, face_index, batch_size=100):
+        """Load every stored encoding from a Pinecone index; readers keep the current snapshot meanwhile"""
+        with self.lock:
+            self.pending = []
+        entries = []
+        try:
+            for id_batch in face_index.list():
+                for i in range(0, len(id_batch), batch_size):
+                    fetched = face_index.fetch(ids=id_batch[i:i + batch_size])
+                    for vector_id, vector in fetched.vectors.items():
+                        metadata = vector.metadata or {}
+                        entries.append((vector_id, metadata.get('name', 'Unknown'), vector.values))
+        except Exception:
+            with self.lock:
+                self.pending = None
+            raise
+        self.load(entries)
+        self.refresh_at = time.monotonic() + self.max_age if self.max_age else None
+
+    def refresh_if_stale(self, face_index):
+        """Start a background reload from the index once max_age has passed"""
+        if self.refresh_at is None or time.monotonic() < self.refresh_at:
+            return
+        if not self.reload_lock.acquire(blocking=False):
+            return  # Already reloading
+
+        def reload():
+            try:
+                self.load_from_index(face_index)
+            except Exception as e:
+                logger.error(f"Error reloading the face gallery, keeping the current one: {e}")
+                self.refresh_at = time.monotonic() + self.RETRY_DELAY
+            finally:
+                self.reload_lock.release()
+
+        try:
+            threading.Thread(target=reload, name="face-gallery-reload", daemon=True).start()
+        except Exception:
+            self.reload_lock.release()
+            raise
+
+    def add(self, student_id, name, encoding):
+        """Add or replace the encoding of a student"""
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(1, self.dimension)
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append((self._add, (student_id, name, encoding)))
+            self._add(student_id, name, encoding)
+
+    def _add(self, student_id, name, encoding):
+        matrix, _, ids, names = self._snapshot
+        existing = np.flatnonzero(ids == student_id)
+        if existing.size:
+            matrix = matrix.copy()
+            names = names.copy()
+            matrix[existing[0]] = encoding[0]
+            names[existing[0]] = name
+        else:
+            matrix = np.vstack([matrix, encoding])
+            ids = np.append(ids, np.array([student_id], dtype=object))
+            names = np.append(names, np.array([name], dtype=object))
+        self._snapshot = self._build(matrix, ids, names)
+        self.version += 1
+
+    def remove(self, student_id):
+        """Remove a student from the gallery"""
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append((self._remove, (student_id,)))
+            return self._remove(student_id)
+
+    def _remove(self, student_id):
+        matrix, _, ids, names = self._snapshot
+        keep = ids != student_id
+        if keep.all():
+            return False
+        self._snapshot = self._build(matrix[keep], ids[keep], names[keep])
+        self.version += 1
+        return True
+
+    def subset(self, student_ids):
+        """
+        Build a gallery restricted to the given students
+
+        Args:
+            student_ids: Iterable of student IDs to keep (e.g. a subject roster)
+
+        Returns:
+            New FaceGallery holding only the matching rows
+        """
+        wanted = set(student_ids)
+        matrix, _, ids, names = self._snapshot
+        keep = np.fromiter((student_id in wanted for student_id in ids), dtype=bool, count=len(ids))
+
+        gallery = FaceGallery(self.dimension, max_age=0)
+        gallery._snapshot = self._build(matrix[keep], ids[keep], names[keep])
+        return gallery
+
+    def distances(self, encodings):
+        """
+        Squared euclidean distances between query encodings and the gallery
+
+        Squared distances match the scores Pinecone returns for the
+        euclidean metric, so config.FACE_THRESHOLD means the same thing here.
+
+        Args:
+            encodings: (N, D) array of query encodings
+
+        Returns:
+            (N, M) float32 array of distances, with the gallery snapshot used
+        """
+        snapshot = self._snapshot
+        matrix, norms = snapshot[0], snapshot[1]
+        queries = np.ascontiguousarray(encodings, dtype=np.float32).reshape(-1, self.dimension)
+        query_norms = np.einsum('ij,ij->i', queries, queries)
+
+        # ||q||^2 + ||g||^2 - 2 q.g, with the cross term as a single GEMM
+        distances = queries @ matrix.T
+        distances *= -2
+        distances += query_norms[:, np.newaxis]
+        distances += norms[np.newaxis, :]
+        np.maximum(distances, 0, out=distances)
+        return distances, snapshot
+
+    def top_k(self, encodings, k=1):
+        """
+        Ranked candidate matches for a batch of encodings
+
+        Args:
+            encodings: (N, D) array of query encodings
+            k: Number of candidates to return per query
+
+        Returns:
+            List with one entry per query, each a list of (student_id, name,
+            score) tuples ordered best first. Scores are not thresholded and
+            queries containing NaN get no candidates.
+        """
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dimension)
+        k = min(k, len(self))
+        if k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        distances, (_, _, ids, names) = self.distances(queries)
+        if k < distances.shape[1]:
+            candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.tile(np.arange(distances.shape[1]), (len(queries), 1))
+        candidate_scores = np.take_along_axis(distances, candidates, axis=1)
+        order = np.argsort(candidate_scores, axis=1)
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+        valid = ~np.isnan(queries).any(axis=1)
+        return [
+            [(ids[index], names[index], float(score)) for index, score in zip(row, scores)] if ok else []
+            for row, scores, ok in zip(candidates, candidate_scores, valid)
+        ]
+
+    def match(self, encodings):
+        """
+        Match a batch of encodings against the gallery
+
+        Args:
+            encodings: (N, D) array of query encodings
+
+        Returns:
+            List of (student_id, name, score) tuples, one per query, in the
+            same form as StorageService.find_matching_face
+        """
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dimension)
+        if not len(self):
+            return [(None, "Unknown", 1.0) for _ in range(len(queries))]
+
+        distances, (_, _, ids, names) = self.distances(queries)
+        best = np.argmin(distances, axis=1)
+        best_scores = distances[np.arange(len(queries)), best]
+
+        results = []
+        for index, score in zip(best, best_scores):
+            if score < config.FACE_THRESHOLD:
+                results.append((ids[index], names[index], float(score)))
+            else:
+                results.append((None, "Unknown", 1.0))
+        return results
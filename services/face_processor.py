@@ -0,0 +1,151 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from io import BytesIO
+from PIL import Image
+
+from config import config
+from services.face_service import FaceService
+
+logger = logging.getLogger(__name__)
+
+def _init_worker():
+    """Preload the dlib models in a worker process"""
+    # face_recognition loads its models on import; run one tiny detection and
+    # encoding so the first real job does not pay for page faults and warm-up
+    blank = np.zeros((64, 64, 3), dtype=np.uint8)
+    FaceService.encode_faces(blank, [(0, 63, 63, 0)])
+    logger.info(f"Face worker {os.getpid()} ready")
+
+def _warm_up():
+    return os.getpid()
+
+def _detect_and_encode(image_data):
+    """Detect, encode and crop every face in an image (runs in a worker)"""
+    np_image, face_locations = FaceService.detect_faces(image_data)
+    encodings = FaceService.encode_faces(np_image, face_locations)
+
+    pil_image = Image.fromarray(np_image)
+    face_crops = []
+    for face_location in face_locations:
+        try:
+            face_crops.append(FaceService.crop_face(pil_image, face_location))
+        except Exception as e:
+            logger.error(f"Could not crop face {face_location}: {e}")
+            face_crops.append(None)
+
+    # Keep a size-capped copy so the annotated view can be rendered later on demand
+    preview, preview_scale = FaceService.resize_to_max(pil_image, config.ANNOTATED_MAX_DIMENSION)
+
+    return {
+        'face_locations': face_locations,
+        'encodings': encodings,
+        'face_crops': face_crops,
+        'preview': FaceService.image_to_jpeg(preview),
+        'preview_scale': preview_scale
+    }
+
+def _render_annotated(preview, preview_scale, face_locations, names, student_ids, image_format, quality):
+    """Draw face boxes and labels on the preview image (runs in a worker)"""
+    np_image = np.asarray(Image.open(BytesIO(preview)).convert('RGB'))
+    scaled_locations = [tuple(int(v * preview_scale) for v in face_location) for face_location in face_locations]
+    pil_image = FaceService.draw_face_rectangles(np_image, scaled_locations, names, student_ids)
+    return FaceService.encode_image(pil_image, image_format, quality)
+
+class FaceProcessor:
+    """
+    Executes CPU-bound face processing in a fixed-size process pool
+
+    dlib detection and encoding hold the GIL, so running them in threads of
+    the web process serializes concurrent uploads. Each worker process loads
+    the models once and then serves jobs for any session.
+    """
+
+    def __init__(self, max_workers=None, start_method=None):
+        self.max_workers = max_workers or config.FACE_WORKERS
+        self.start_method = start_method or config.FACE_WORKER_START_METHOD
+        self.executor = None
+        self.generation = 0  # Bumped each time the pool is replaced
+        self.lock = threading.Lock()  # Serializes pool restarts
+        self._start(self.start_method)
+
+    def _start(self, start_method):
+        context = multiprocessing.get_context(start_method)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=context,
+            initializer=_init_worker
+        )
+        self.generation += 1
+        # Start every worker now, before the web process spins up other threads
+        for future in [self.executor.submit(_warm_up) for _ in range(self.max_workers)]:
+            future.result()
+        logger.info(f"Started face processing pool with {self.max_workers} workers ({start_method})")
+
+    def _restart(self, generation):
+        """Replace a broken pool, unless another caller already has"""
+        with self.lock:
+            if generation != self.generation:
+                return
+            logger.error("Face processing pool broke, restarting it")
+            self.executor.shutdown(wait=False)
+            # By now the web process runs other threads, so forking it is unsafe
+            start_method = self.start_method
+            if start_method == "fork":
+                start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._start(start_method)
+
+    def _run(self, fn, *args):
+        """Run a job in the pool, restarting the pool once if a worker died"""
+        with self.lock:
+            executor, generation = self.executor, self.generation
+        try:
+            return executor.submit(fn, *args).result()
+        except BrokenProcessPool:
+            self._restart(generation)
+            return self.executor.submit(fn, *args).result()
+
+    def detect_and_encode(self, image_data):
+        """
+        Detect, encode and crop all faces of an image in a worker process
+
+        Args:
+            image_data: Binary image data
+
+        Returns:
+            Dictionary with face_locations, encodings ((N, 128) float32, NaN
+            rows for faces that could not be encoded), face_crops (JPEG bytes
+            per face, None if cropping failed) and a size-capped preview JPEG
+            with its preview_scale
+        """
+        return self._run(_detect_and_encode, image_data)
+
+    def render_annotated(self, preview, preview_scale, face_locations, names, student_ids=None,
+                         image_format=None, quality=None):
+        """
+        Render the annotated image in a worker process
+
+        Args:
+            preview: Encoded size-capped image returned by detect_and_encode
+            preview_scale: Scale of the preview relative to the original image
+            face_locations: Face locations in original image coordinates
+            names: Label for each face
+            student_ids: Student ID for each face (None if unrecognized)
+            image_format: "webp" or "jpeg" (defaults to config.ANNOTATED_FORMAT)
+            quality: Encoder quality (defaults to config.ANNOTATED_QUALITY)
+
+        Returns:
+            Tuple of (image bytes, mimetype)
+        """
+        return self._run(
+            _render_annotated, preview, preview_scale, face_locations, names, student_ids,
+            image_format or config.ANNOTATED_FORMAT, quality or config.ANNOTATED_QUALITY
+        )
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        self.executor.shutdown(wait=True)
@@ -3,6 +3,7 @@ import logging
 import numpy as np
 from io import BytesIO
 from PIL import Image, ImageDraw
+import dlib
 import face_recognition
 
 from config import config
@@ -14,22 +15,71 @@ class FaceService:
     Service for face recognition operations
     """
     
+    # Registration and live uploads must use the same landmark model, or their encodings are not comparable
+    LANDMARK_MODEL = "small"
+    
     @staticmethod
-    def detect_faces(image_data):
+    def detect_faces(image_data, downscale=None):
         """
         Detect faces in the given image
         
+        With downscaling enabled, detection runs on a reduced copy of the image
+        and the boxes are mapped back to full-resolution coordinates, so the
+        returned image can still be encoded at full quality.
+        
         Args:
             image_data: Binary image data
+            downscale: Detect on a reduced copy (defaults to config.FACE_DETECTION_DOWNSCALE)
         
         Returns:
-            np_image: Numpy array of the image
+            np_image: Numpy array of the full-resolution image
             face_locations: List of face locations (top, right, bottom, left)
         """
         np_image = face_recognition.load_image_file(BytesIO(image_data))
-        face_locations = face_recognition.face_locations(np_image)
+        
+        if downscale is None:
+            downscale = config.FACE_DETECTION_DOWNSCALE
+        scale = FaceService.detection_scale(np_image.shape) if downscale else 1.0
+        
+        if scale >= 1.0:
+            return np_image, face_recognition.face_locations(np_image)
+        
+        height, width = np_image.shape[:2]
+        small_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        small_image = np.asarray(Image.fromarray(np_image).resize(small_size, Image.BILINEAR))
+        
+        face_locations = []
+        for top, right, bottom, left in face_recognition.face_locations(small_image):
+            face_locations.append((
+                max(0, int(top / scale)),
+                min(width, int(right / scale)),
+                min(height, int(bottom / scale)),
+                max(0, int(left / scale))
+            ))
+        
+        logger.info(f"Detected {len(face_locations)} faces at scale {scale:.2f} ({small_size[0]}x{small_size[1]})")
         return np_image, face_locations
     
+    @staticmethod
+    def detection_scale(image_shape):
+        """
+        Choose the detection scale for an image
+        
+        The image is shrunk until the smallest expected face is just large
+        enough for the HOG detector; it is never enlarged.
+        
+        Args:
+            image_shape: Shape of the image array (height, width, ...)
+        
+        Returns:
+            Scale factor in (0, 1]
+        """
+        height, width = image_shape[:2]
+        min_face_size = config.FACE_MIN_SIZE_RATIO * min(height, width)
+        if min_face_size <= 0:
+            return 1.0
+        return min(1.0, config.FACE_DETECTOR_MIN_SIZE / min_face_size)
+    
     @staticmethod
     def encode_face(np_image, face_location):
         """
@@ -42,12 +92,52 @@ class FaceService:
         Returns:
             Face encoding as a numpy array
         """
-        face_encodings = face_recognition.face_encodings(np_image, [face_location])
+        face_encodings = face_recognition.face_encodings(np_image, [face_location], model=FaceService.LANDMARK_MODEL)
         if not face_encodings:
             raise ValueError("Could not encode face")
         
         return np.array(face_encodings[0], dtype=np.float32)
     
+    @staticmethod
+    def encode_faces(np_image, face_locations):
+        """
+        Generate face encodings for all faces in a single pass
+        
+        Landmarks for every location are predicted first, with the same model
+        as encode_face so the encodings are comparable to the registered ones,
+        and the descriptors are then computed in one batched dlib call. If the
+        batch fails, each face is encoded on its own so one bad face does not
+        lose the others.
+        
+        Args:
+            np_image: Numpy array of the image
+            face_locations: List of face locations (top, right, bottom, left)
+        
+        Returns:
+            (N, 128) float32 numpy array; rows of faces that could not be
+            encoded are filled with NaN
+        """
+        encodings = np.full((len(face_locations), config.FACE_ENCODING_DIMENSION), np.nan, dtype=np.float32)
+        if not face_locations:
+            return encodings
+        
+        try:
+            landmarks = dlib.full_object_detections()
+            landmarks.extend(face_recognition.api._raw_face_landmarks(
+                np_image, face_locations, model=FaceService.LANDMARK_MODEL
+            ))
+            descriptors = face_recognition.api.face_encoder.compute_face_descriptor(np_image, landmarks)
+            encodings[:] = np.array([np.array(descriptor) for descriptor in descriptors], dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Batch face encoding failed, encoding faces individually: {e}")
+            for i, face_location in enumerate(face_locations):
+                try:
+                    encodings[i] = FaceService.encode_face(np_image, face_location)
+                except Exception as face_error:
+                    logger.error(f"Could not encode face {i}: {face_error}")
+        
+        return encodings
+    
     @staticmethod
     def draw_face_rectangles(np_image, face_locations, names, student_ids=None):
         """
@@ -89,17 +179,66 @@ class FaceService:
             face_location: Face location (top, right, bottom, left)
         
         Returns:
-            Base64 encoded string of the cropped face
+            JPEG bytes of the cropped face
         """
         top, right, bottom, left = face_location
         face_img = pil_image.crop((left, top, right, bottom))
         
-        # Convert to base64
-        face_img_io = BytesIO()
-        face_img.save(face_img_io, 'JPEG')
-        face_img_io.seek(0)
+        return FaceService.image_to_jpeg(face_img)
+    
+    @staticmethod
+    def image_to_jpeg(pil_image):
+        """
+        Encode PIL Image as JPEG
+        
+        Args:
+            pil_image: PIL Image
+        
+        Returns:
+            JPEG bytes of the image
+        """
+        buffer = BytesIO()
+        pil_image.save(buffer, format="JPEG")
+        return buffer.getvalue()
+    
+    @staticmethod
+    def resize_to_max(pil_image, max_dimension):
+        """
+        Shrink an image so its longest side fits max_dimension
+        
+        Args:
+            pil_image: PIL Image
+            max_dimension: Maximum width or height in pixels
+        
+        Returns:
+            Tuple of (PIL Image, scale factor applied)
+        """
+        scale = min(1.0, max_dimension / max(pil_image.size))
+        if scale >= 1.0:
+            return pil_image, 1.0
+        size = (max(1, round(pil_image.width * scale)), max(1, round(pil_image.height * scale)))
+        return pil_image.resize(size, Image.BILINEAR), scale
+    
+    @staticmethod
+    def encode_image(pil_image, image_format="jpeg", quality=75):
+        """
+        Encode PIL Image in a compact format
         
-        return base64.b64encode(face_img_io.getvalue()).decode('ascii')
+        Args:
+            pil_image: PIL Image
+            image_format: "webp" or "jpeg" (progressive)
+            quality: Encoder quality (0-100)
+        
+        Returns:
+            Tuple of (image bytes, mimetype)
+        """
+        buffer = BytesIO()
+        if image_format == "webp":
+            pil_image.save(buffer, format="WEBP", quality=quality, method=4)
+            return buffer.getvalue(), "image/webp"
+        
+        pil_image.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+        return buffer.getvalue(), "image/jpeg"
     
     @staticmethod
     def image_to_base64(pil_image):
@@ -112,6 +251,4 @@ class FaceService:
         Returns:
             Base64 encoded string of the image
         """
-        buffer = BytesIO()
-        pil_image.save(buffer, format="JPEG")
-        return base64.b64encode(buffer.getvalue()).decode('ascii')
\ No newline at end of file
+        return base64.b64encode(FaceService.image_to_jpeg(pil_image)).decode('ascii')
\ No newline at end of file
@@ -0,0 +1,123 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """Raised when a job is rejected because the queue is saturated"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class JobQueue:
+    """
+    Bounded FIFO job queue served by a fixed number of worker threads
+
+    Jobs beyond max_depth are rejected up front instead of piling up, so the
+    number of in-flight sessions (and the images they hold) stays bounded.
+    Queue position and wait estimates come from a moving average of recent
+    job durations.
+    """
+
+    def __init__(self, handler, workers, max_depth, initial_estimate=10.0, name='job-queue'):
+        self.handler = handler
+        self.workers = workers
+        self.max_depth = max_depth
+        self.avg_duration = float(initial_estimate)
+        self.queue = deque()
+        self.running = {}  # job_id -> start time
+        self.completed = 0
+        self.rejected = 0
+        self.cond = threading.Condition()
+
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True).start()
+
+    def submit(self, job_id):
+        """
+        Enqueue a job
+
+        Returns:
+            1-based position of the job in the queue
+
+        Raises:
+            QueueFullError: If the queue already holds max_depth jobs
+        """
+        with self.cond:
+            if len(self.queue) >= self.max_depth:
+                self.rejected += 1
+                raise QueueFullError(self._retry_after())
+            self.queue.append(job_id)
+            self.cond.notify()
+            return len(self.queue)
+
+    def is_full(self):
+        """Check whether a new job would be rejected"""
+        with self.cond:
+            return len(self.queue) >= self.max_depth
+
+    def position(self, job_id):
+        """
+        Get the 1-based queue position of a job
+
+        Returns:
+            Position, 0 if the job is running, None if it is not known
+        """
+        with self.cond:
+            if job_id in self.running:
+                return 0
+            try:
+                return self.queue.index(job_id) + 1
+            except ValueError:
+                return None
+
+    def estimated_wait(self, position):
+        """Estimate seconds until a job at the given queue position starts"""
+        if not position:
+            return 0
+        # Jobs ahead are served workers-at-a-time
+        return math.ceil(position / self.workers) * self.avg_duration
+
+    def _retry_after(self):
+        return max(1, math.ceil(self.estimated_wait(len(self.queue) - self.max_depth + 1)))
+
+    def retry_after(self):
+        """Seconds a rejected client should wait before retrying"""
+        with self.cond:
+            return self._retry_after()
+
+    def stats(self):
+        """Get queue depth and throughput counters"""
+        with self.cond:
+            return {
+                'queued': len(self.queue),
+                'running': len(self.running),
+                'max_depth': self.max_depth,
+                'workers': self.workers,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_duration': round(self.avg_duration, 2)
+            }
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                job_id = self.queue.popleft()
+                self.running[job_id] = time.monotonic()
+
+            try:
+                self.handler(job_id)
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}")
+            finally:
+                with self.cond:
+                    duration = time.monotonic() - self.running.pop(job_id)
+                    # Exponential moving average keeps estimates tracking recent load
+                    self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+                    self.completed += 1
@@ -0,0 +1,164 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class ReferenceCache:
+    """
+    Read-through cache for a rarely changing table (departments, subjects, faculty)
+
+    The whole table is cached as one snapshot with a dictionary index by id,
+    so listing it and looking rows up by id are served without a database
+    round trip until the TTL expires. Tables larger than max_entries are not
+    snapshotted; rows looked up by id are then kept in a bounded LRU instead.
+    Writes must call invalidate().
+
+    Cached objects are shared between callers and must not be modified in
+    place: build new values and write them back, which invalidates the cache.
+    """
+
+    def __init__(self, name, key, load_all, load_one=None, load_many=None, ttl=None, max_entries=None):
+        """
+        Args:
+            name: Table name, used in logs and stats
+            key: Attribute holding a row's id
+            load_all: Callable returning every row
+            load_one: Callable returning one row by id (None if missing)
+            load_many: Callable returning the existing rows among a list of ids
+            ttl: Seconds cached rows are served for
+            max_entries: Most rows held at once
+        """
+        self.name = name
+        self.key = key
+        self.load_all = load_all
+        self.load_one = load_one
+        self.load_many = load_many
+        self.ttl = ttl if ttl is not None else config.REFERENCE_CACHE_TTL
+        self.max_entries = max_entries or config.REFERENCE_CACHE_MAX_ENTRIES
+        self.lock = threading.Lock()
+        self.generation = 0  # Bumped on invalidate so loads started before a write are not cached
+        self.hits = 0
+        self.misses = 0
+        self._snapshot = None  # (loaded_at, rows, index by id)
+        self._rows = OrderedDict()  # id -> (loaded_at, row), used when there is no snapshot
+
+    def _fresh(self, loaded_at):
+        return time.monotonic() - loaded_at < self.ttl
+
+    def all(self):
+        """Get every row of the table"""
+        with self.lock:
+            snapshot = self._snapshot
+            if snapshot and self._fresh(snapshot[0]):
+                self.hits += 1
+                return list(snapshot[1])
+            self.misses += 1
+            generation = self.generation
+
+        rows = self.load_all()
+        index = {getattr(row, self.key): row for row in rows}
+        with self.lock:
+            if generation == self.generation:
+                if len(rows) <= self.max_entries:
+                    self._snapshot = (time.monotonic(), rows, index)
+                    self._rows.clear()
+                else:
+                    logger.warning(f"{self.name} has {len(rows)} rows, more than the cache holds; not caching it")
+        return list(rows)
+
+    def get(self, row_id):
+        """Get one row by id, or None if it does not exist"""
+        with self.lock:
+            snapshot = self._snapshot
+            if snapshot and self._fresh(snapshot[0]):
+                self.hits += 1
+                return snapshot[2].get(row_id)
+
+            cached = self._rows.get(row_id)
+            if cached and self._fresh(cached[0]):
+                self._rows.move_to_end(row_id)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+            generation = self.generation
+
+        if self.load_one is None:
+            return next((row for row in self.all() if getattr(row, self.key) == row_id), None)
+
+        row = self.load_one(row_id)
+        with self.lock:
+            if row is not None and generation == self.generation:
+                self._rows[row_id] = (time.monotonic(), row)
+                self._rows.move_to_end(row_id)
+                while len(self._rows) > self.max_entries:
+                    self._rows.popitem(last=False)
+        return row
+
+    def get_many(self, row_ids):
+        """
+        Get several rows by id with at most one database query
+
+        Returns:
+            Dictionary of id -> row for the ids that exist
+        """
+        found = {}
+        missing = []
+        with self.lock:
+            snapshot = self._snapshot
+            if snapshot and self._fresh(snapshot[0]):
+                self.hits += 1
+                return {row_id: snapshot[2][row_id] for row_id in row_ids if row_id in snapshot[2]}
+
+            for row_id in dict.fromkeys(row_ids):
+                cached = self._rows.get(row_id)
+                if cached and self._fresh(cached[0]):
+                    self._rows.move_to_end(row_id)
+                    found[row_id] = cached[1]
+                else:
+                    missing.append(row_id)
+            if not missing:
+                self.hits += 1
+                return found
+            self.misses += 1
+            generation = self.generation
+
+        if self.load_many is None:
+            index = {getattr(row, self.key): row for row in self.all()}
+            found.update((row_id, index[row_id]) for row_id in missing if row_id in index)
+            return found
+
+        rows = self.load_many(missing)
+        with self.lock:
+            for row in rows:
+                row_id = getattr(row, self.key)
+                found[row_id] = row
+                if generation == self.generation:
+                    self._rows[row_id] = (time.monotonic(), row)
+                    self._rows.move_to_end(row_id)
+            while len(self._rows) > self.max_entries:
+                self._rows.popitem(last=False)
+        return found
+
+    def invalidate(self):
+        """Drop every cached row; call after any write to the table"""
+        with self.lock:
+            self.generation += 1
+            self._snapshot = None
+            self._rows.clear()
+
+    def stats(self):
+        """Get hit/miss counters and the number of cached rows"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0,
+                'entries': len(self._snapshot[1]) if self._snapshot else len(self._rows),
+                'ttl': self.ttl,
+                'max_entries': self.max_entries
+            }
@@ -1,66 +1,185 @@
 from config import config
+import heapq
+import logging
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 import uuid
 import threading
+from collections import OrderedDict
 
-class SessionManager:
+from services.session_store import SessionStore
+
+logger = logging.getLogger(__name__)
+
+class TimedLock:
+    """
+    Mutex that records how long it is held
+    
+    Statistics are updated while the lock is still held, so recording them
+    needs no extra synchronization.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)  # Untimed access for waiters
+        self.acquisitions = 0
+        self.total_wait = 0.0
+        self.total_hold = 0.0
+        self.max_hold = 0.0
+        self._acquired_at = 0.0
+    
+    def __enter__(self):
+        requested_at = time.perf_counter()
+        self.lock.acquire()
+        self._acquired_at = time.perf_counter()
+        self.total_wait += self._acquired_at - requested_at
+        return self
+    
+    def __exit__(self, *exc_info):
+        held = time.perf_counter() - self._acquired_at
+        self.acquisitions += 1
+        self.total_hold += held
+        self.max_hold = max(self.max_hold, held)
+        self.lock.release()
+
+def _lock_summary(locks):
+    """Aggregate hold-time statistics of a group of TimedLocks"""
+    acquisitions = sum(lock.acquisitions for lock in locks)
+    total_hold = sum(lock.total_hold for lock in locks)
+    total_wait = sum(lock.total_wait for lock in locks)
+    return {
+        'locks': len(locks),
+        'acquisitions': acquisitions,
+        'avg_hold_ms': round(total_hold / acquisitions * 1000, 4) if acquisitions else 0,
+        'max_hold_ms': round(max((lock.max_hold for lock in locks), default=0) * 1000, 4),
+        'avg_wait_ms': round(total_wait / acquisitions * 1000, 4) if acquisitions else 0
+    }
+
+class SessionManager(SessionStore):
+    """
+    In-memory store of face processing sessions
+    
+    A short registry lock guards session membership, the LRU order, the
+    expiry heap and byte accounting. The contents of each session are guarded
+    by one of SESSION_LOCK_STRIPES striped locks, so unrelated sessions never
+    contend. Locks are always taken stripe first, then registry.
+    """
+    # Session fields holding binary payloads, counted against the memory budget
+    BINARY_FIELDS = ('image', 'preview')
+    
     def __init__(self, cleanup_interval=300, pending_ttl=900):
         self.sessions = {}
-        self.lock = threading.RLock()  # Reentrant lock for thread safety
-        self.cleanup_interval = config.SESSION_CLEANUP_INTERVAL  # Cleanup every 5 minutes
-        self.pending_ttl = config.SESSION_PENDING_TTL  # Pending/incomplete sessions expire after 15 minutes
+        self.finished = OrderedDict()  # Completed/errored session IDs, least recently used first
+        self.total_bytes = 0
+        self.evicted_count = 0
+        self.memory_budget = config.SESSION_MEMORY_BUDGET
+        self.expiry_heap = []  # (deadline, session_id) min-heap; entries not matching 'scheduled_at' are stale
+        self.lock = TimedLock()  # Registry lock
+        self.stripes = [TimedLock() for _ in range(config.SESSION_LOCK_STRIPES)]
+        self.cleanup_interval = config.SESSION_CLEANUP_INTERVAL  # Longest the cleanup thread sleeps
+        # Idle time after which a session expires, by status
+        self.ttls = {
+            'queued': config.SESSION_PENDING_TTL,
+            'processing': config.SESSION_PENDING_TTL,
+            'completed': config.SESSION_COMPLETED_TTL,
+            'error': config.SESSION_ERROR_TTL
+        }
         
         # Start the cleanup thread for abandoned sessions
         self.cleanup_thread = threading.Thread(target=self._cleanup_abandoned_sessions, daemon=True)
         self.cleanup_thread.start()
     
+    def _stripe(self, session_id):
+        """Get the lock guarding a session's contents"""
+        return self.stripes[hash(session_id) % len(self.stripes)]
+    
     def create_session(self, image_data):
         """Create a new processing session"""
-        print("Creating new session")
+        session_id = str(uuid.uuid4())
+        session_data = {
+            'image': image_data,
+            'processed_faces': [],
+            'status': 'processing',
+            'created_at': datetime.now(),
+            'last_accessed': datetime.now(),
+            'viewed_count': 0,  # Track how many times the completed result has been viewed
+            'version': 0,  # Incremented on every update
+            'size_bytes': len(image_data or b'')
+        }
+        
         with self.lock:
-            session_id = str(uuid.uuid4())
-            self.sessions[session_id] = {
-                'image': image_data,
-                'processed_faces': [],
-                'status': 'processing',
-                'created_at': datetime.now(),
-                'last_accessed': datetime.now(),
-                'viewed_count': 0  # Track how many times the completed result has been viewed
-            }
-            return session_id
+            self.sessions[session_id] = session_data
+            self._schedule_expiry(session_id, session_data)
+            self.total_bytes += session_data['size_bytes']
+            evicted = self._enforce_budget()
+        
+        self._notify(evicted)
+        logger.debug(f"Created session {session_id}")
+        return session_id
     
     def get_session(self, session_id):
         """Get session data and update last accessed time"""
-        print("Getting session data")
         with self.lock:
-            if session_id not in self.sessions:
+            session_data = self.sessions.get(session_id)
+            if session_data is None:
                 return None
-            
+            self._touch(session_id)
+            self._schedule_expiry(session_id, session_data)
+        
+        with self._stripe(session_id):
             # Update last accessed time
-            session_data = self.sessions[session_id]
             session_data['last_accessed'] = datetime.now()
             
             # If session is completed, increment the viewed counter
+            viewed_out = False
             if session_data['status'] == 'completed':
                 session_data['viewed_count'] += 1
                 
                 # If it's been viewed 3 times after completion, mark for cleanup
                 # This gives the frontend enough time to get the final result
-                if session_data['viewed_count'] >= config.SESSION_MAX_VIEWS:
-                    self._mark_for_cleanup(session_id)
-                    
+                viewed_out = session_data['viewed_count'] >= config.SESSION_MAX_VIEWS
+        
+        if viewed_out:
+            self._mark_for_cleanup(session_id)
+        
+        return session_data
+    
+    def peek_session(self, session_id):
+        """Get session data without counting it as a view of the result"""
+        with self.lock:
+            session_data = self.sessions.get(session_id)
+            if session_data is None:
+                return None
+            self._touch(session_id)
+            self._schedule_expiry(session_id, session_data)
             return session_data
     
+    def get_version(self, session_id):
+        """Get a session's (version, status) without touching or viewing it"""
+        with self.lock:
+            session_data = self.sessions.get(session_id)
+            if session_data is None:
+                return None
+            return session_data.get('version', 0), session_data['status']
+    
+    def get_blob(self, session_id, field, key=None):
+        """Get a binary payload of a session, or one entry of face_images"""
+        session_data = self.peek_session(session_id)
+        if session_data is None:
+            return None
+        value = session_data.get(field)
+        if key is not None:
+            value = (value or {}).get(key)
+        return value
+    
     def update_session(self, session_id, updates):
         """Update session with new data"""
-        print("Updating session data")
-        with self.lock:
-            if session_id not in self.sessions:
+        stripe = self._stripe(session_id)
+        with stripe:
+            session_data = self.sessions.get(session_id)
+            if session_data is None:
                 return False
             
             # Update the session data
-            session_data = self.sessions[session_id]
             for key, value in updates.items():
                 if key != 'created_at':  # Don't allow changing creation time
                     session_data[key] = value
@@ -73,39 +192,186 @@ class SessionManager:
                 # Reset viewed count when marking complete
                 session_data['viewed_count'] = 0
             
-            return True
+            session_data['version'] += 1
+            size_bytes = self._session_bytes(session_data)
+            
+            with self.lock:
+                if session_id in self.sessions:
+                    # Finished sessions become candidates for eviction
+                    if session_data['status'] in ('completed', 'error'):
+                        self.finished[session_id] = True
+                        self.finished.move_to_end(session_id)
+                    
+                    self._schedule_expiry(session_id, session_data)
+                    
+                    # Re-account the session's payload size
+                    self.total_bytes += size_bytes - session_data['size_bytes']
+                    session_data['size_bytes'] = size_bytes
+                evicted = self._enforce_budget()
+            
+            stripe.changed.notify_all()
+        
+        self._notify(evicted)
+        logger.debug(f"Updated session {session_id} to version {session_data['version']}")
+        return True
+    
+    def wait_for_update(self, session_id, version, timeout=None):
+        """
+        Wait until a session moves past the given version
+        
+        Does not count as a view of a completed session.
+        
+        Returns:
+            Shallow copy of the session data (which may still be at the same
+            version if the timeout expired), or None if the session is gone
+        """
+        changed = self._stripe(session_id).changed
+        with changed:
+            changed.wait_for(
+                lambda: session_id not in self.sessions or self.sessions[session_id]['version'] != version,
+                timeout
+            )
+            session_data = self.sessions.get(session_id)
+            return dict(session_data) if session_data is not None else None
+    
+    def delete_session(self, session_id):
+        """Remove a session immediately"""
+        with self.lock:
+            removed = self._remove(session_id)
+        if removed:
+            self._notify([session_id])
+        return removed
+    
+    def memory_stats(self):
+        """Get the memory footprint of the session store"""
+        with self.lock:
+            by_status = {}
+            for session_data in self.sessions.values():
+                stats = by_status.setdefault(session_data['status'], {'sessions': 0, 'bytes': 0})
+                stats['sessions'] += 1
+                stats['bytes'] += session_data['size_bytes']
+            
+            return {
+                'sessions': len(self.sessions),
+                'total_bytes': self.total_bytes,
+                'budget_bytes': self.memory_budget,
+                'evicted': self.evicted_count,
+                'by_status': by_status
+            }
+    
+    def lock_stats(self):
+        """Get hold and wait times of the registry and session locks"""
+        return {
+            'registry': _lock_summary([self.lock]),
+            'sessions': _lock_summary(self.stripes)
+        }
+    
+    @classmethod
+    def _session_bytes(cls, session_data):
+        """Count the binary payload held by a session"""
+        size_bytes = sum(len(session_data.get(field) or b'') for field in cls.BINARY_FIELDS)
+        size_bytes += sum(len(image) for image in (session_data.get('face_images') or {}).values())
+        annotated_image = session_data.get('annotated_image')
+        if annotated_image:
+            size_bytes += len(annotated_image[0])
+        return size_bytes
+    
+    def _notify(self, session_ids):
+        """Wake waiters of removed sessions (no locks may be held)"""
+        for session_id in session_ids:
+            changed = self._stripe(session_id).changed
+            with changed:
+                changed.notify_all()
+    
+    def _touch(self, session_id):
+        """Mark a finished session as recently used (registry lock must be held)"""
+        if session_id in self.finished:
+            self.finished.move_to_end(session_id)
+    
+    def _schedule_expiry(self, session_id, session_data):
+        """
+        Push the session's idle deadline out according to its status (registry lock must be held)
+        
+        The heap keeps one live entry per session. A later deadline is only
+        recorded on the session and picked up when its entry is popped; an
+        earlier one (e.g. after an error) gets a new entry right away.
+        """
+        expires_at = time.monotonic() + self.ttls.get(session_data['status'], config.SESSION_PENDING_TTL)
+        session_data['expires_at'] = expires_at
+        if 'scheduled_at' not in session_data or expires_at < session_data['scheduled_at']:
+            session_data['scheduled_at'] = expires_at
+            heapq.heappush(self.expiry_heap, (expires_at, session_id))
+    
+    def _pop_expired(self, now):
+        """Remove sessions whose deadline has passed (registry lock must be held)"""
+        expired_sessions = []
+        while self.expiry_heap and self.expiry_heap[0][0] <= now:
+            deadline, session_id = heapq.heappop(self.expiry_heap)
+            session_data = self.sessions.get(session_id)
+            if session_data is None or session_data['scheduled_at'] != deadline:
+                continue  # Session already removed, or a stale entry
+            
+            if session_data['expires_at'] > now:
+                # Accessed since this entry was pushed; reschedule at the real deadline
+                session_data['scheduled_at'] = session_data['expires_at']
+                heapq.heappush(self.expiry_heap, (session_data['expires_at'], session_id))
+                continue
+            
+            self._remove(session_id)
+            expired_sessions.append(session_id)
+        return expired_sessions
+    
+    def _remove(self, session_id):
+        """Remove a session and release its accounted bytes (registry lock must be held)"""
+        session_data = self.sessions.pop(session_id, None)
+        if session_data is None:
+            return False
+        self.finished.pop(session_id, None)
+        self.total_bytes -= session_data['size_bytes']
+        return True
+    
+    def _enforce_budget(self):
+        """
+        Evict least recently used finished sessions while over the memory budget
+        (registry lock must be held)
+        
+        Returns:
+            IDs of the evicted sessions, whose waiters must be notified
+        """
+        evicted = []
+        while self.total_bytes > self.memory_budget and self.finished:
+            session_id = next(iter(self.finished))
+            self._remove(session_id)
+            self.evicted_count += 1
+            evicted.append(session_id)
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} sessions to stay within the memory budget")
+        return evicted
     
     def _mark_for_cleanup(self, session_id):
         """Mark a session for cleanup or remove it immediately"""
-        print("Marking session for cleanup")
         # Remove immediately
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-            print(f"Session {session_id} has been removed after completion")
+        if self.delete_session(session_id):
+            logger.debug(f"Session {session_id} has been removed after completion")
     
     def _cleanup_abandoned_sessions(self):
-        """Background thread to clean up abandoned sessions"""
-        print("Starting session cleanup thread")
+        """Background thread to expire idle sessions as their deadlines pass"""
+        logger.info("Starting session cleanup thread")
         while True:
-            time.sleep(self.cleanup_interval)
             try:
-                now = datetime.now()
-                expired_sessions = []
-                
                 with self.lock:
-                    # Find abandoned sessions (started but never completed)
-                    for session_id, data in self.sessions.items():
-                        # Only clean up sessions that are still processing but haven't been
-                        # accessed in a while (likely abandoned uploads)
-                        if (data['status'] == 'processing' and 
-                            now - data['last_accessed'] > timedelta(seconds=self.pending_ttl)):
-                            expired_sessions.append(session_id)
-                    
-                    # Delete expired sessions
-                    for session_id in expired_sessions:
-                        del self.sessions[session_id]
+                    expired_sessions = self._pop_expired(time.monotonic())
+                    next_deadline = self.expiry_heap[0][0] if self.expiry_heap else None
                 
+                self._notify(expired_sessions)
                 if expired_sessions:
-                    print(f"Cleaned up {len(expired_sessions)} abandoned sessions")
+                    logger.info(f"Cleaned up {len(expired_sessions)} expired sessions")
             except Exception as e:
-                print(f"Error in session cleanup: {str(e)}")
\ No newline at end of file
+                logger.error(f"Error in session cleanup: {str(e)}")
+                next_deadline = None
+            
+            # Sleep until the earliest deadline, but wake regularly to pick up new sessions
+            delay = self.cleanup_interval
+            if next_deadline is not None:
+                delay = min(delay, max(next_deadline - time.monotonic(), 0.01))
+            time.sleep(delay)
@@ -0,0 +1,58 @@
+# services/session_store.py
+from abc import ABC, abstractmethod
+from typing import Optional, Dict, Any, Tuple
+
+class SessionStore(ABC):
+    """Abstract interface for face processing session storage"""
+
+    # Session fields holding binary payloads; read them with get_blob
+    BLOB_FIELDS = ('image', 'preview', 'annotated_image', 'face_images')
+
+    @abstractmethod
+    def create_session(self, image_data: bytes) -> str:
+        """Create a new processing session and return its ID"""
+        pass
+
+    @abstractmethod
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Get session data, counting it as a view of a completed result"""
+        pass
+
+    @abstractmethod
+    def peek_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Get session data without counting it as a view of the result"""
+        pass
+
+    @abstractmethod
+    def get_version(self, session_id: str) -> Optional[Tuple[int, str]]:
+        """Get a session's (version, status) without touching or viewing it"""
+        pass
+
+    @abstractmethod
+    def get_blob(self, session_id: str, field: str, key=None):
+        """Get a binary payload of a session, or one entry of face_images"""
+        pass
+
+    @abstractmethod
+    def update_session(self, session_id: str, updates: Dict[str, Any]) -> bool:
+        """Update session with new data"""
+        pass
+
+    @abstractmethod
+    def wait_for_update(self, session_id: str, version, timeout: float = None) -> Optional[Dict[str, Any]]:
+        """Wait until a session moves past the given version"""
+        pass
+
+    @abstractmethod
+    def delete_session(self, session_id: str) -> bool:
+        """Remove a session immediately"""
+        pass
+
+    @abstractmethod
+    def memory_stats(self) -> Dict[str, Any]:
+        """Get the memory footprint of the session store"""
+        pass
+
+    def lock_stats(self) -> Dict[str, Any]:
+        """Get lock hold times, for stores that use in-process locks"""
+        return {}
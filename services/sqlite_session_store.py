@@ -0,0 +1,394 @@
+# services/sqlite_session_store.py
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import config
+from services.session_store import SessionStore
+
+logger = logging.getLogger(__name__)
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store shared by every worker process on a host
+
+    Sessions live in a SQLite database in WAL mode, so readers never block
+    the writer and any Flask worker can answer for a session created by
+    another. Binary payloads are kept in their own table, so a per-face
+    update only inserts the new crop. There is no cross-process notification,
+    so waiting for updates polls the version column.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            viewed_count INTEGER NOT NULL DEFAULT 0,
+            data BLOB NOT NULL,
+            size_bytes INTEGER NOT NULL DEFAULT 0,
+            last_accessed REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at);
+        CREATE INDEX IF NOT EXISTS sessions_status_last_accessed ON sessions (status, last_accessed);
+        CREATE TABLE IF NOT EXISTS session_blobs (
+            session_id TEXT NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (session_id, name)
+        );
+        -- Running total of size_bytes, so the budget check does not scan every session
+        CREATE TABLE IF NOT EXISTS session_totals (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_bytes INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO session_totals (id, total_bytes) SELECT 1, COALESCE(SUM(size_bytes), 0) FROM sessions;
+        CREATE TRIGGER IF NOT EXISTS sessions_total_insert AFTER INSERT ON sessions BEGIN
+            UPDATE session_totals SET total_bytes = total_bytes + NEW.size_bytes WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS sessions_total_update AFTER UPDATE OF size_bytes ON sessions BEGIN
+            UPDATE session_totals SET total_bytes = total_bytes + NEW.size_bytes - OLD.size_bytes WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS sessions_total_delete AFTER DELETE ON sessions BEGIN
+            UPDATE session_totals SET total_bytes = total_bytes - OLD.size_bytes WHERE id = 1;
+        END;
+    """
+
+    # Fields kept in their own columns rather than in the pickled data
+    COLUMN_FIELDS = ('status', 'version', 'viewed_count', 'size_bytes', 'last_accessed')
+
+    def __init__(self, path=None):
+        self.path = path or config.SESSION_DB_PATH
+        self.local = threading.local()  # One connection per thread
+        self.memory_budget = config.SESSION_MEMORY_BUDGET
+        self.poll_interval = config.SESSION_DB_POLL_INTERVAL
+        self.cleanup_interval = config.SESSION_CLEANUP_INTERVAL
+        self.evicted_count = 0  # Evictions made by this process
+        self.touch_interval = config.SESSION_TOUCH_INTERVAL
+        self.touched = {}  # session_id -> time this process last wrote its access time
+        self.touched_lock = threading.Lock()
+        self.ttls = {
+            'queued': config.SESSION_PENDING_TTL,
+            'processing': config.SESSION_PENDING_TTL,
+            'completed': config.SESSION_COMPLETED_TTL,
+            'error': config.SESSION_ERROR_TTL
+        }
+
+        self._connection().executescript(self.SCHEMA)
+
+        # Every process runs its own cleanup; deleting expired rows is idempotent
+        self.cleanup_thread = threading.Thread(target=self._cleanup_expired_sessions, daemon=True)
+        self.cleanup_thread.start()
+
+    def _connection(self):
+        """Get this thread's connection"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=config.SESSION_DB_TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Run statements in a write transaction"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _expires_at(self, status, now):
+        return now + self.ttls.get(status, config.SESSION_PENDING_TTL)
+
+    def _load(self, conn, session_id):
+        """Read a session's non-binary fields"""
+        row = conn.execute(
+            "SELECT status, version, viewed_count, size_bytes, last_accessed, data FROM sessions WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        session_data = pickle.loads(row[5])
+        session_data.update({
+            'status': row[0],
+            'version': row[1],
+            'viewed_count': row[2],
+            'size_bytes': row[3],
+            'last_accessed': datetime.fromtimestamp(row[4])
+        })
+        return session_data
+
+    def _touch(self, conn, session_id, now, force=False):
+        """
+        Refresh a session's last access time and idle deadline
+
+        Reads only write it once per touch_interval, so polling a session
+        does not queue behind uploads for SQLite's single writer lock. The
+        deadline may therefore be up to touch_interval early.
+        """
+        with self.touched_lock:
+            if not force and now - self.touched.get(session_id, 0) < self.touch_interval:
+                return
+            self.touched[session_id] = now
+        conn.execute(
+            """UPDATE sessions SET last_accessed = :now,
+                   expires_at = :now + CASE status
+                       WHEN 'completed' THEN :completed
+                       WHEN 'error' THEN :error
+                       ELSE :pending END
+               WHERE session_id = :session_id""",
+            {
+                'now': now,
+                'completed': self.ttls['completed'],
+                'error': self.ttls['error'],
+                'pending': self.ttls['processing'],
+                'session_id': session_id
+            }
+        )
+
+    def create_session(self, image_data):
+        """Create a new processing session"""
+        session_id = str(uuid.uuid4())
+        now = time.time()
+        session_data = {
+            'processed_faces': [],
+            'created_at': datetime.now()
+        }
+
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO sessions (session_id, status, data, last_accessed, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, 'processing', pickle.dumps(session_data), now, self._expires_at('processing', now))
+            )
+            self._write_blob(conn, session_id, 'image', image_data)
+            self._update_size(conn, session_id)
+            self._enforce_budget(conn)
+
+        logger.debug(f"Created session {session_id}")
+        return session_id
+
+    def get_session(self, session_id):
+        """Get session data and update last accessed time"""
+        conn = self._connection()
+        session_data = self._load(conn, session_id)
+        if session_data is None or session_data['status'] != 'completed':
+            # No view to count; read without the writer lock, like peek_session
+            if session_data is not None:
+                self._touch(conn, session_id, time.time())
+            return session_data
+
+        with self._transaction() as conn:
+            self._touch(conn, session_id, time.time(), force=True)
+            session_data = self._load(conn, session_id)
+            if session_data is None:
+                return None
+
+            # If session is completed, increment the viewed counter
+            if session_data['status'] == 'completed':
+                session_data['viewed_count'] += 1
+                if session_data['viewed_count'] >= config.SESSION_MAX_VIEWS:
+                    # Viewed enough times after completion; remove it
+                    conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                else:
+                    conn.execute(
+                        "UPDATE sessions SET viewed_count = ? WHERE session_id = ?",
+                        (session_data['viewed_count'], session_id)
+                    )
+
+            return session_data
+
+    def peek_session(self, session_id):
+        """Get session data without counting it as a view of the result"""
+        conn = self._connection()
+        self._touch(conn, session_id, time.time())
+        return self._load(conn, session_id)
+
+    def get_version(self, session_id):
+        """Get a session's (version, status) without touching or viewing it"""
+        row = self._connection().execute(
+            "SELECT version, status FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def get_blob(self, session_id, field, key=None):
+        """Get a binary payload of a session, or one entry of face_images"""
+        conn = self._connection()
+        name = f"{field}/{key}" if key is not None else field
+        row = conn.execute(
+            "SELECT data FROM session_blobs WHERE session_id = ? AND name = ?",
+            (session_id, name)
+        ).fetchone()
+        if row is None:
+            return None
+        self._touch(conn, session_id, time.time())
+        return pickle.loads(row[0])
+
+    def update_session(self, session_id, updates):
+        """Update session with new data"""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT status, viewed_count, data FROM sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+            if row is None:
+                return False
+
+            status, viewed_count, session_data = row[0], row[1], pickle.loads(row[2])
+            for key, value in updates.items():
+                if key == 'created_at' or (key in self.COLUMN_FIELDS and key != 'status'):
+                    continue  # Don't allow changing creation time or bookkeeping fields
+                if key == 'status':
+                    status = value
+                elif key in self.BLOB_FIELDS:
+                    self._write_blob(conn, session_id, key, value)
+                else:
+                    session_data[key] = value
+
+            # Reset viewed count when marking complete
+            if updates.get('status') == 'completed':
+                viewed_count = 0
+
+            now = time.time()
+            conn.execute(
+                """UPDATE sessions SET status = ?, viewed_count = ?, data = ?, version = version + 1,
+                       last_accessed = ?, expires_at = ?
+                   WHERE session_id = ?""",
+                (status, viewed_count, pickle.dumps(session_data), now, self._expires_at(status, now), session_id)
+            )
+            self._update_size(conn, session_id)
+            self._enforce_budget(conn)
+            return True
+
+    def wait_for_update(self, session_id, version, timeout=None):
+        """
+        Wait until a session moves past the given version
+
+        Does not count as a view of a completed session.
+
+        Returns:
+            Session data (which may still be at the same version if the
+            timeout expired), or None if the session is gone
+        """
+        conn = self._connection()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            row = conn.execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+
+            remaining = deadline - time.monotonic() if deadline is not None else self.poll_interval
+            if row[0] != version or remaining <= 0:
+                return self._load(conn, session_id)
+            time.sleep(min(self.poll_interval, remaining))
+
+    def delete_session(self, session_id):
+        """Remove a session immediately"""
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount > 0
+
+    def memory_stats(self):
+        """Get the footprint of the session store"""
+        conn = self._connection()
+        by_status = {}
+        total_sessions = 0
+        total_bytes = 0
+        for status, sessions, size_bytes in conn.execute(
+            "SELECT status, COUNT(*), COALESCE(SUM(size_bytes), 0) FROM sessions GROUP BY status"
+        ):
+            by_status[status] = {'sessions': sessions, 'bytes': size_bytes}
+            total_sessions += sessions
+            total_bytes += size_bytes
+
+        return {
+            'sessions': total_sessions,
+            'total_bytes': total_bytes,
+            'budget_bytes': self.memory_budget,
+            'evicted': self.evicted_count,
+            'by_status': by_status
+        }
+
+    def _write_blob(self, conn, session_id, field, value):
+        """Store a binary field; face_images only inserts crops not stored yet"""
+        if field == 'face_images':
+            stored = {
+                name for (name,) in conn.execute(
+                    "SELECT name FROM session_blobs WHERE session_id = ? AND name LIKE 'face_images/%'",
+                    (session_id,)
+                )
+            }
+            conn.executemany(
+                "INSERT INTO session_blobs (session_id, name, data) VALUES (?, ?, ?)",
+                [
+                    (session_id, f"face_images/{key}", pickle.dumps(image))
+                    for key, image in (value or {}).items()
+                    if f"face_images/{key}" not in stored
+                ]
+            )
+        elif value is None:
+            conn.execute("DELETE FROM session_blobs WHERE session_id = ? AND name = ?", (session_id, field))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO session_blobs (session_id, name, data) VALUES (?, ?, ?)",
+                (session_id, field, pickle.dumps(value))
+            )
+
+    def _update_size(self, conn, session_id):
+        conn.execute(
+            """UPDATE sessions SET size_bytes = (
+                   SELECT COALESCE(SUM(LENGTH(data)), 0) FROM session_blobs WHERE session_id = ?
+               ) WHERE session_id = ?""",
+            (session_id, session_id)
+        )
+
+    def _enforce_budget(self, conn):
+        """Evict least recently used finished sessions while over the memory budget"""
+        total_bytes = conn.execute("SELECT total_bytes FROM session_totals WHERE id = 1").fetchone()[0]
+        if total_bytes <= self.memory_budget:
+            return
+
+        candidates = conn.execute(
+            "SELECT session_id, size_bytes FROM sessions WHERE status IN ('completed', 'error') ORDER BY last_accessed"
+        ).fetchall()
+        evicted = 0
+        for session_id, size_bytes in candidates:
+            if total_bytes <= self.memory_budget:
+                break
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            total_bytes -= size_bytes
+            evicted += 1
+
+        if evicted:
+            self.evicted_count += evicted
+            logger.info(f"Evicted {evicted} sessions to stay within the memory budget")
+
+    def _cleanup_expired_sessions(self):
+        """Background thread to delete sessions whose idle deadline has passed"""
+        logger.info("Starting session cleanup thread")
+        while True:
+            time.sleep(self.cleanup_interval)
+            try:
+                now = time.time()
+                with self._transaction() as conn:
+                    expired = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,)).rowcount
+                with self.touched_lock:
+                    self.touched = {
+                        session_id: touched_at for session_id, touched_at in self.touched.items()
+                        if now - touched_at < self.touch_interval
+                    }
+                if expired:
+                    logger.info(f"Cleaned up {expired} expired sessions")
+            except Exception as e:
+                logger.error(f"Error in session cleanup: {str(e)}")
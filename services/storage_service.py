@@ -1,11 +1,18 @@
 # services/storage_service.py
 import logging
+import threading
+from collections import OrderedDict
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pinecone import Pinecone, ServerlessSpec
 
 from config import config
+from services.attendance_summary import AttendanceSummaryStore
 from services.database_interface import DatabaseInterface
+from services.enrollment_index import EnrollmentIndex
+from services.face_gallery import FaceGallery
+from services.reference_cache import ReferenceCache
 from services.supabase_adapter import SupabaseAdapter
 
 logger = logging.getLogger(__name__)
@@ -15,6 +22,22 @@ class StorageService:
     Service for database and vector storage operations
     Uses dependency injection for database operations
     """
+    # Local face gallery shared by every StorageService in the process
+    _face_gallery = None
+    _face_gallery_lock = threading.Lock()
+    # Per-subject sub-galleries, least recently used first: subject_id -> (gallery version, roster, gallery)
+    _subject_galleries = OrderedDict()
+    _subject_galleries_lock = threading.Lock()
+    # Attendance counters shared by every StorageService in the process
+    _attendance_summaries = None
+    _attendance_summaries_lock = threading.Lock()
+    # Enrollments in both directions, shared by every StorageService in the process
+    _enrollment_index = None
+    _enrollment_index_lock = threading.Lock()
+    # Read-through caches of departments, subjects and faculty shared by every StorageService
+    _reference_caches = None
+    _reference_caches_lock = threading.Lock()
+    
     def __init__(self, db_adapter: DatabaseInterface = None):
         # Use provided adapter or default to Supabase
         self.db = db_adapter or SupabaseAdapter()
@@ -35,6 +58,91 @@ class StorageService:
             )
         
         self.face_index = self.pc.Index(config.PINECONE_INDEX_NAME)
+        self.match_backend = config.FACE_MATCH_BACKEND
+    
+    @property
+    def face_gallery(self):
+        """Local face gallery, loaded from Pinecone on first use and reloaded when older than FACE_GALLERY_MAX_AGE"""
+        if StorageService._face_gallery is None:
+            with StorageService._face_gallery_lock:
+                if StorageService._face_gallery is None:
+                    gallery = FaceGallery()
+                    gallery.load_from_index(self.face_index)
+                    StorageService._face_gallery = gallery
+        gallery = StorageService._face_gallery
+        gallery.refresh_if_stale(self.face_index)
+        return gallery
+    
+    @property
+    def attendance_summaries(self):
+        """Attendance counters, built from the database on first read"""
+        if StorageService._attendance_summaries is None:
+            with StorageService._attendance_summaries_lock:
+                if StorageService._attendance_summaries is None:
+                    StorageService._attendance_summaries = AttendanceSummaryStore(
+                        lambda: self.db.iter_attendance_records(
+                            columns=['student_id', 'subject_id', 'status', 'class_date']
+                        )
+                    )
+        return StorageService._attendance_summaries
+    
+    @property
+    def enrollment_index(self):
+        """Enrollment index, loaded from the database on first read"""
+        if StorageService._enrollment_index is None:
+            with StorageService._enrollment_index_lock:
+                if StorageService._enrollment_index is None:
+                    StorageService._enrollment_index = EnrollmentIndex(self.db.get_all_enrollments)
+        return StorageService._enrollment_index
+    
+    @property
+    def reference_caches(self):
+        """Read-through caches of the rarely changing tables, by table name"""
+        if StorageService._reference_caches is None:
+            with StorageService._reference_caches_lock:
+                if StorageService._reference_caches is None:
+                    StorageService._reference_caches = {
+                        'departments': ReferenceCache('departments', 'dept_id', self.db.get_all_departments),
+                        'subjects': ReferenceCache(
+                            'subjects', 'subject_id', self.db.get_all_subjects,
+                            self.db.get_subject_by_id, self.db.get_subjects_by_ids
+                        ),
+                        'faculty': ReferenceCache(
+                            'faculty', 'faculty_id', self.db.get_all_faculty,
+                            self.db.get_faculty_by_id, self.db.get_faculty_by_ids
+                        )
+                    }
+        return StorageService._reference_caches
+    
+    def reference_cache_stats(self):
+        """Get hit/miss counters of the reference data caches"""
+        return {name: cache.stats() for name, cache in self.reference_caches.items()}
+    
+    def get_subject_gallery(self, subject_id, student_ids):
+        """Get the cached gallery restricted to a subject's enrolled roster"""
+        gallery = self.face_gallery
+        roster = frozenset(student_ids)
+        if subject_id is None:
+            return gallery.subset(roster)
+        
+        galleries = StorageService._subject_galleries
+        with StorageService._subject_galleries_lock:
+            cached = galleries.get(subject_id)
+            if cached and cached[0] == gallery.version and cached[1] == roster:
+                galleries.move_to_end(subject_id)
+                return cached[2]
+        
+        version = gallery.version
+        subject_gallery = gallery.subset(roster)
+        with StorageService._subject_galleries_lock:
+            # Sub-galleries of an older gallery version will never be served again
+            for stale_id in [cached_id for cached_id, cached in galleries.items() if cached[0] != version]:
+                del galleries[stale_id]
+            galleries[subject_id] = (version, roster, subject_gallery)
+            galleries.move_to_end(subject_id)
+            while len(galleries) > config.SUBJECT_GALLERY_CACHE_SIZE:
+                galleries.popitem(last=False)
+        return subject_gallery
     
     # Face recognition methods (Pinecone operations)
     def store_student_face(self, student_id, name, face_encoding):
@@ -47,73 +155,179 @@ class StorageService:
                 "student_id": student_id
             }
         }])
+        
+        # Keep the local gallery in sync with the system of record
+        if StorageService._face_gallery is not None:
+            StorageService._face_gallery.add(student_id, name, face_encoding)
     
-    def find_matching_face(self, face_encoding):
-        """Find a matching face in Pinecone"""
-        results = self.face_index.query(
-            vector=face_encoding.tolist(),
+    def find_matching_face(self, face_encoding, subject_id=None, candidate_ids=None):
+        """
+        Find a matching face using the configured matching backend
+        
+        If candidate_ids is given, only those students are searched (e.g. the
+        roster of subject_id) instead of every registered student.
+        """
+        candidates = self.find_matching_faces(
+            face_encoding,
             top_k=1,
-            include_metadata=True
-        )
+            subject_id=subject_id,
+            candidate_ids=candidate_ids
+        )[0]
+        return self.best_match(candidates)
+    
+    def find_matching_faces(self, encodings, top_k=1, filter=None, subject_id=None, candidate_ids=None):
+        """
+        Find ranked candidate matches for all faces of a photo at once
+        
+        The local backend answers the whole batch with one matrix product.
+        Pinecone has no multi-vector query, so the faces are queried with a
+        bounded number of concurrent requests.
+        
+        Args:
+            encodings: (N, 128) array of face encodings
+            top_k: Number of candidates per face
+            filter: Pinecone metadata filter (Pinecone backend only)
+            subject_id: Subject used to cache the roster gallery (local backend)
+            candidate_ids: Restrict the search to these student IDs
+        
+        Returns:
+            List with one entry per face, each a list of (student_id, name,
+            score) tuples ordered best first. Scores are not thresholded.
+        """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, config.FACE_ENCODING_DIMENSION)
+        if candidate_ids is not None and not candidate_ids:
+            return [[] for _ in range(len(encodings))]
+        
+        if self.match_backend == 'local':
+            if filter is not None:
+                raise ValueError("Metadata filters are only supported by the Pinecone backend")
+            if candidate_ids is not None:
+                return self.get_subject_gallery(subject_id, candidate_ids).top_k(encodings, top_k)
+            return self.face_gallery.top_k(encodings, top_k)
+        
+        query_filter = filter
+        if candidate_ids is not None:
+            roster_filter = {"student_id": {"$in": list(candidate_ids)}}
+            query_filter = {"$and": [filter, roster_filter]} if filter else roster_filter
+        
+        def query(face_encoding):
+            if np.isnan(face_encoding).any():
+                return []
+            results = self.face_index.query(
+                vector=face_encoding.tolist(),
+                top_k=top_k,
+                include_metadata=True,
+                filter=query_filter
+            )
+            return [
+                (match['id'], match['metadata'].get('name', 'Unknown'), match['score'])
+                for match in results['matches']
+            ]
         
-        if results['matches'] and results['matches'][0]['score'] < config.FACE_THRESHOLD:
-            match = results['matches'][0]
-            return match['id'], match['metadata'].get('name', 'Unknown'), match['score']
+        if len(encodings) == 1:
+            return [query(encodings[0])]
         
+        with ThreadPoolExecutor(max_workers=config.VECTOR_QUERY_CONCURRENCY) as executor:
+            return list(executor.map(query, encodings))
+    
+    @staticmethod
+    def best_match(candidates):
+        """Pick the top candidate if it is within the face threshold"""
+        if candidates and candidates[0][2] < config.FACE_THRESHOLD:
+            return candidates[0]
         return None, "Unknown", 1.0
     
     # Database operations (delegated to adapter)
+    # Departments, subjects and faculty are read through caches; writes
+    # invalidate them even when they fail, since callers may have modified
+    # the cached objects before writing them back
     def add_department(self, department):
         """Add a department"""
-        return self.db.add_department(department)
+        try:
+            return self.db.add_department(department)
+        finally:
+            self.reference_caches['departments'].invalidate()
     
     def get_all_departments(self):
         """Get all departments"""
-        return self.db.get_all_departments()
+        return self.reference_caches['departments'].all()
+    
+    def get_department_by_id(self, dept_id):
+        """Get department by ID"""
+        return self.reference_caches['departments'].get(dept_id)
     
     def update_department(self, dept_id, updates):
         """Update a department"""
-        return self.db.update_department(dept_id, updates)
+        try:
+            return self.db.update_department(dept_id, updates)
+        finally:
+            self.reference_caches['departments'].invalidate()
     
     def add_faculty(self, faculty):
         """Add a faculty member"""
-        return self.db.add_faculty(faculty)
+        try:
+            return self.db.add_faculty(faculty)
+        finally:
+            self.reference_caches['faculty'].invalidate()
     
     def get_all_faculty(self):
         """Get all faculty members"""
-        return self.db.get_all_faculty()
+        return self.reference_caches['faculty'].all()
     
     def get_faculty_by_id(self, faculty_id):
         """Get faculty by ID"""
-        return self.db.get_faculty_by_id(faculty_id)
+        return self.reference_caches['faculty'].get(faculty_id)
+    
+    def get_faculty_by_ids(self, faculty_ids):
+        """Get the faculty members among a list of IDs"""
+        return list(self.reference_caches['faculty'].get_many(faculty_ids).values())
     
     def update_faculty(self, faculty_id, updates):
         """Update a faculty member"""
-        return self.db.update_faculty(faculty_id, updates)
+        try:
+            return self.db.update_faculty(faculty_id, updates)
+        finally:
+            self.reference_caches['faculty'].invalidate()
     
     def delete_faculty(self, faculty_id):
         """Delete a faculty member"""
-        return self.db.delete_faculty(faculty_id)
+        try:
+            return self.db.delete_faculty(faculty_id)
+        finally:
+            self.reference_caches['faculty'].invalidate()
     
     def add_subject(self, subject):
         """Add a subject"""
-        return self.db.add_subject(subject)
+        try:
+            return self.db.add_subject(subject)
+        finally:
+            self.reference_caches['subjects'].invalidate()
     
     def get_all_subjects(self):
         """Get all subjects"""
-        return self.db.get_all_subjects()
+        return self.reference_caches['subjects'].all()
     
     def get_subject_by_id(self, subject_id):
         """Get subject by ID"""
-        return self.db.get_subject_by_id(subject_id)
+        return self.reference_caches['subjects'].get(subject_id)
+    
+    def get_subjects_by_ids(self, subject_ids):
+        """Get the subjects among a list of IDs"""
+        return list(self.reference_caches['subjects'].get_many(subject_ids).values())
     
     def update_subject(self, subject_id, updates):
         """Update a subject"""
-        return self.db.update_subject(subject_id, updates)
+        try:
+            return self.db.update_subject(subject_id, updates)
+        finally:
+            self.reference_caches['subjects'].invalidate()
     
     def delete_subject(self, subject_id):
         """Delete a subject"""
-        return self.db.delete_subject(subject_id)
+        try:
+            return self.db.delete_subject(subject_id)
+        finally:
+            self.reference_caches['subjects'].invalidate()
     
     def add_student(self, student):
         """Add a student"""
@@ -123,6 +337,10 @@ class StorageService:
         """Get a student by ID"""
         return self.db.get_student(student_id)
     
+    def get_students_by_ids(self, student_ids):
+        """Get the students among a list of IDs in one query"""
+        return self.db.get_students_by_ids(student_ids)
+    
     def get_all_students(self):
         """Get all students"""
         return self.db.get_all_students()
@@ -141,19 +359,38 @@ class StorageService:
     
     def enroll_student_in_courses(self, student_id, course_ids):
         """Enroll student in multiple courses"""
-        return self.db.enroll_student_in_courses(student_id, course_ids)
+        enrolled_ids = self.db.enroll_student_in_courses(student_id, course_ids)
+        if enrolled_ids is None:
+            return False
+        # Index what the database wrote; the adapter skips courses that do not exist
+        self.enrollment_index.add(student_id, enrolled_ids)
+        return True
+    
+    def unenroll_student_from_course(self, student_id, course_id):
+        """Remove a student from one course"""
+        result = self.db.unenroll_student_from_courses(student_id, [course_id])
+        if result:
+            self.enrollment_index.remove(student_id, [course_id])
+        return result
     
     def clear_student_enrollments(self, student_id):
         """Clear all enrollments for a student"""
-        return self.db.clear_student_enrollments(student_id)
+        result = self.db.clear_student_enrollments(student_id)
+        if result:
+            self.enrollment_index.remove(student_id)
+        return result
     
     def get_student_subjects(self, student_id):
         """Get all subjects a student is enrolled in"""
-        return self.db.get_student_subjects(student_id)
+        return self.get_subjects_by_ids(sorted(self.enrollment_index.subjects_of(student_id)))
     
     def get_enrolled_students(self, subject_id):
         """Get list of student IDs enrolled in a subject"""
-        return self.db.get_enrolled_students(subject_id)
+        return sorted(self.enrollment_index.students_of(subject_id))
+    
+    def get_all_enrollments(self):
+        """Get every enrollment as (student_id, subject_id) pairs"""
+        return self.enrollment_index.all_pairs()
     
     def update_student_semester(self, student_id, semester):
         """Update student's current semester"""
@@ -161,7 +398,22 @@ class StorageService:
     
     def record_attendance(self, attendance):
         """Record student attendance"""
-        return self.db.add_attendance_record(attendance)
+        result = self.db.add_attendance_record(attendance)
+        if result:
+            self.attendance_summaries.apply([attendance])
+        return result
+    
+    def record_attendance_bulk(self, attendance_records):
+        """Record attendance for many students in as few writes as possible"""
+        if not attendance_records:
+            return 0
+        stored = self.db.add_attendance_records(attendance_records)
+        if stored == len(attendance_records):
+            self.attendance_summaries.apply(attendance_records)
+        else:
+            # Unknown which records made it; recount from the database
+            self.attendance_summaries.invalidate()
+        return stored
     
     def get_student_attendance(self, student_id, subject_id=None, start_date=None, end_date=None):
         """Get attendance records for a student"""
@@ -175,10 +427,26 @@ class StorageService:
         
         return self.db.get_attendance_records(filters)
     
+    def iter_attendance_records(self, filters=None, page_size=None, columns=None):
+        """Stream attendance records page by page, ordered by date"""
+        return self.db.iter_attendance_records(filters, page_size, columns)
+    
     def get_subject_attendance(self, subject_id, date=None):
         """Get attendance records for a subject"""
         filters = {'subject_id': subject_id}
         if date:
             filters['date'] = date.isoformat() if hasattr(date, 'isoformat') else date
         
-        return self.db.get_attendance_records(filters)
\ No newline at end of file
+        return self.db.get_attendance_records(filters)
+    
+    def get_attendance_summaries(self, subject_id=None, start_date=None, end_date=None):
+        """Get attendance counts for every student and the number of class days"""
+        filters = {}
+        if subject_id:
+            filters['subject_id'] = subject_id
+        if start_date:
+            filters['start_date'] = start_date.isoformat() if hasattr(start_date, 'isoformat') else start_date
+        if end_date:
+            filters['end_date'] = end_date.isoformat() if hasattr(end_date, 'isoformat') else end_date
+        
+        return self.db.get_attendance_summaries(filters)
@@ -1,6 +1,6 @@
 # services/supabase_adapter.py
 import logging
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator, Tuple
 from supabase import create_client, Client
 from supabase.client import ClientOptions
 
@@ -17,6 +17,9 @@ logger = logging.getLogger(__name__)
 class SupabaseAdapter(DatabaseInterface):
     """Supabase implementation of the database interface"""
     
+    # Natural key of an attendance record: one per student, subject and class date
+    ATTENDANCE_KEY = 'student_id,subject_id,class_date'
+    
     def __init__(self):
         # Initialize Supabase with explicit options to avoid proxy parameter issue
         try:
@@ -36,6 +39,26 @@ class SupabaseAdapter(DatabaseInterface):
                 logger.error(f"Error creating Supabase client: {e2}")
                 raise
     
+    def _select_in(self, table: str, column: str, values: List[str]) -> List[Dict[str, Any]]:
+        """Fetch the rows whose column is in values, a batch of values per request"""
+        values = list(dict.fromkeys(value for value in values if value))
+        records = []
+        batch_size = config.SUPABASE_IN_FILTER_BATCH_SIZE
+        for start in range(0, len(values), batch_size):
+            result = self.supabase.table(table).select("*").in_(column, values[start:start + batch_size]).execute()
+            records.extend(result.data)
+        return records
+    
+    def _select_pages(self, build_query) -> List[Dict[str, Any]]:
+        """Fetch every row of an ordered query, a page per request (the API caps rows per response)"""
+        records = []
+        page_size = config.SUPABASE_PAGE_SIZE
+        while True:
+            result = build_query().range(len(records), len(records) + page_size - 1).execute()
+            records.extend(result.data)
+            if len(result.data) < page_size:
+                return records
+    
     def get_student(self, student_id: str):
         """Get a student by ID"""
         try:
@@ -47,11 +70,19 @@ class SupabaseAdapter(DatabaseInterface):
             logger.error(f"Error getting student: {e}")
             return None
     
+    def get_students_by_ids(self, student_ids: List[str]) -> List[Student]:
+        """Get the students among a list of IDs in one query"""
+        try:
+            return [Student.from_dict(record) for record in self._select_in('students', 'student_id', student_ids)]
+        except Exception as e:
+            logger.error(f"Error getting students by IDs: {e}")
+            return []
+    
     def get_all_students(self) -> List[Student]:
         """Get all students"""
         try:
-            result = self.supabase.table('students').select("*").execute()
-            return [Student.from_dict(record) for record in result.data]
+            records = self._select_pages(lambda: self.supabase.table('students').select("*").order('student_id'))
+            return [Student.from_dict(record) for record in records]
         except Exception as e:
             logger.error(f"Error getting all students: {e}")
             return []
@@ -130,6 +161,14 @@ class SupabaseAdapter(DatabaseInterface):
             logger.error(f"Error getting faculty by ID: {e}")
             return None
     
+    def get_faculty_by_ids(self, faculty_ids: List[str]) -> List[Faculty]:
+        """Get the faculty members among a list of IDs in one query"""
+        try:
+            return [Faculty.from_dict(record) for record in self._select_in('faculty', 'faculty_id', faculty_ids)]
+        except Exception as e:
+            logger.error(f"Error getting faculty members by IDs: {e}")
+            return []
+    
     def add_faculty(self, faculty: Faculty) -> bool:
         """Add a new faculty member"""
         try:
@@ -160,8 +199,8 @@ class SupabaseAdapter(DatabaseInterface):
     def get_all_subjects(self) -> List[Subject]:
         """Get all subjects"""
         try:
-            result = self.supabase.table('subjects').select("*").execute()
-            return [Subject.from_dict(record) for record in result.data]
+            records = self._select_pages(lambda: self.supabase.table('subjects').select("*").order('subject_id'))
+            return [Subject.from_dict(record) for record in records]
         except Exception as e:
             logger.error(f"Error getting all subjects: {e}")
             return []
@@ -177,6 +216,14 @@ class SupabaseAdapter(DatabaseInterface):
             logger.error(f"Error getting subject by ID: {e}")
             return None
     
+    def get_subjects_by_ids(self, subject_ids: List[str]) -> List[Subject]:
+        """Get the subjects among a list of IDs in one query"""
+        try:
+            return [Subject.from_dict(record) for record in self._select_in('subjects', 'subject_id', subject_ids)]
+        except Exception as e:
+            logger.error(f"Error getting subjects by IDs: {e}")
+            return []
+    
     def add_subject(self, subject: Subject) -> bool:
         """Add a new subject"""
         try:
@@ -213,80 +260,51 @@ class SupabaseAdapter(DatabaseInterface):
             logger.error(f"Error getting courses by department and semester: {e}")
             return []
     
-    def enroll_student_in_courses(self, student_id: str, course_ids: List[str]) -> bool:
-        """Enroll student in multiple courses"""
+    def enroll_student_in_courses(self, student_id: str, course_ids: List[str]) -> Optional[List[str]]:
+        """Enroll student in multiple courses, returning the IDs of the courses enrolled in"""
         try:
-            # Get the student to verify they exist
-            student = self.get_student(student_id)
-            if not student:
+            # Verify the student and courses exist
+            if not self.student_exists(student_id):
                 logger.error(f"Student {student_id} not found")
-                return False
+                return None
             
-            # Get student's currently enrolled courses
-            student_courses = student.course_enrolled_ids or []
-            courses_added = []
-            
-            # Update each course's enrolled_students list
+            found_ids = {subject.subject_id for subject in self.get_subjects_by_ids(course_ids)}
             for course_id in course_ids:
-                # Get current course data
-                course_result = self.supabase.table('subjects').select("*").eq('subject_id', course_id).execute()
-                
-                if not course_result.data:
+                if course_id not in found_ids:
                     logger.error(f"Course {course_id} not found")
-                    continue
-                
-                course_data = course_result.data[0]
-                enrolled_students = course_data.get('enrolled_students', [])
-                
-                # Add student if not already enrolled
-                if student_id not in enrolled_students:
-                    enrolled_students.append(student_id)
-                    self.supabase.table('subjects').update({
-                        'enrolled_students': enrolled_students
-                    }).eq('subject_id', course_id).execute()
-                    courses_added.append(course_id)
-            
-            # Update student's enrolled courses
-            for course_id in courses_added:
-                if course_id not in student_courses:
-                    student_courses.append(course_id)
             
-            # Update student document if any courses were added
-            if courses_added:
-                student.course_enrolled_ids = student_courses
-                self.update_student(student)
+            # Insert one row per new enrollment; existing enrollments are left as they are
+            rows = [
+                {'student_id': student_id, 'subject_id': course_id}
+                for course_id in dict.fromkeys(course_ids) if course_id in found_ids
+            ]
+            if rows:
+                self.supabase.table('enrollments').upsert(
+                    rows, on_conflict='student_id,subject_id', ignore_duplicates=True
+                ).execute()
             
-            return True
+            return [row['subject_id'] for row in rows]
         except Exception as e:
             logger.error(f"Error enrolling student in courses: {e}")
+            return None
+    
+    def unenroll_student_from_courses(self, student_id: str, course_ids: List[str]) -> bool:
+        """Remove a student from several courses"""
+        try:
+            self.supabase.table('enrollments').delete().eq('student_id', student_id).in_('subject_id', list(course_ids)).execute()
+            return True
+        except Exception as e:
+            logger.error(f"Error unenrolling student from courses: {e}")
             return False
     
     def clear_student_enrollments(self, student_id: str) -> bool:
         """Clear all enrollments for a student"""
         try:
-            # Get the student record
-            student = self.get_student(student_id)
-            if not student:
+            if not self.student_exists(student_id):
                 logger.error(f"Student {student_id} not found")
                 return False
             
-            # Clear the student's course enrollments
-            student.course_enrolled_ids = []
-            self.update_student(student)
-            
-            # Find all subjects that have this student enrolled and remove them
-            subjects_result = self.supabase.table('subjects').select("*").execute()
-            
-            for subject_data in subjects_result.data:
-                enrolled_students = subject_data.get('enrolled_students', [])
-                
-                # If student is enrolled in this subject, remove them
-                if student_id in enrolled_students:
-                    enrolled_students.remove(student_id)
-                    self.supabase.table('subjects').update({
-                        'enrolled_students': enrolled_students
-                    }).eq('subject_id', subject_data['subject_id']).execute()
-            
+            self.supabase.table('enrollments').delete().eq('student_id', student_id).execute()
             return True
         except Exception as e:
             logger.error(f"Error clearing student enrollments: {e}")
@@ -295,17 +313,9 @@ class SupabaseAdapter(DatabaseInterface):
     def get_student_subjects(self, student_id: str) -> List[Subject]:
         """Get all subjects a student is enrolled in"""
         try:
-            student = self.get_student(student_id)
-            if not student or not student.course_enrolled_ids:
-                return []
-            
-            subjects = []
-            for subject_id in student.course_enrolled_ids:
-                subject = self.get_subject_by_id(subject_id)
-                if subject:
-                    subjects.append(subject)
-            
-            return subjects
+            # Embed the subject rows through the enrollments foreign key
+            result = self.supabase.table('enrollments').select("subjects(*)").eq('student_id', student_id).execute()
+            return [Subject.from_dict(record['subjects']) for record in result.data if record.get('subjects')]
         except Exception as e:
             logger.error(f"Error getting student subjects: {e}")
             return []
@@ -313,14 +323,25 @@ class SupabaseAdapter(DatabaseInterface):
     def get_enrolled_students(self, subject_id: str) -> List[str]:
         """Get list of student IDs enrolled in a subject"""
         try:
-            result = self.supabase.table('subjects').select("enrolled_students").eq('subject_id', subject_id).execute()
-            if result.data:
-                return result.data[0].get('enrolled_students', [])
-            return []
+            records = self._select_pages(
+                lambda: self.supabase.table('enrollments').select("student_id").eq('subject_id', subject_id).order('student_id')
+            )
+            return [record['student_id'] for record in records]
         except Exception as e:
             logger.error(f"Error getting enrolled students: {e}")
             return []
     
+    def get_all_enrollments(self) -> List[Tuple[str, str]]:
+        """Get every enrollment as (student_id, subject_id) pairs"""
+        try:
+            records = self._select_pages(
+                lambda: self.supabase.table('enrollments').select("student_id,subject_id").order('student_id').order('subject_id')
+            )
+            return [(record['student_id'], record['subject_id']) for record in records]
+        except Exception as e:
+            logger.error(f"Error getting all enrollments: {e}")
+            return []
+    
     def update_student_semester(self, student_id: str, semester: int) -> bool:
         """Update student's current semester"""
         try:
@@ -335,32 +356,149 @@ class SupabaseAdapter(DatabaseInterface):
     def get_attendance_records(self, filters: Dict[str, Any] = None) -> List[Attendance]:
         """Get attendance records with optional filters"""
         try:
-            query = self.supabase.table('attendance').select("*")
-            
-            if filters:
-                for key, value in filters.items():
-                    if key == 'student_id':
-                        query = query.eq('student_id', value)
-                    elif key == 'subject_id':
-                        query = query.eq('subject_id', value)
-                    elif key == 'date':
-                        query = query.eq('date', value)
-                    elif key == 'start_date':
-                        query = query.gte('date', value)
-                    elif key == 'end_date':
-                        query = query.lte('date', value)
-            
-            result = query.execute()
-            return [Attendance.from_dict(record) for record in result.data]
+            return list(self.iter_attendance_records(filters))
         except Exception as e:
             logger.error(f"Error getting attendance records: {e}")
             return []
     
-    def add_attendance_record(self, attendance: Attendance) -> bool:
-        """Add an attendance record"""
+    def iter_attendance_records(self, filters: Dict[str, Any] = None, page_size: int = None,
+                                columns: List[str] = None) -> Iterator[Attendance]:
+        """
+        Stream attendance records ordered by (date, attendance_id)
+        
+        Pages are fetched with keyset pagination, each page continuing after
+        the last (date, attendance_id) of the previous one, so memory stays
+        bounded by the page size and deep pages cost the same as the first.
+        Errors are raised rather than logged, so a truncated stream is never
+        mistaken for a complete one.
+        
+        Args:
+            filters: Same filters as get_attendance_records
+            page_size: Rows per request (at most the API's max_rows)
+            columns: Columns to fetch; defaults to all
+        """
+        page_size = page_size or config.SUPABASE_PAGE_SIZE
+        selected = "*"
+        if columns:
+            # The cursor needs the key columns even when the caller does not
+            selected = ",".join(dict.fromkeys(list(columns) + ['date', 'attendance_id']))
+        
+        cursor = None
+        while True:
+            query = self._apply_attendance_filters(self.supabase.table('attendance').select(selected), filters)
+            if cursor:
+                last_date, last_id = cursor
+                query = query.or_(f'date.gt."{last_date}",and(date.eq."{last_date}",attendance_id.gt."{last_id}")')
+            result = query.order('date').order('attendance_id').limit(page_size).execute()
+            
+            for record in result.data:
+                yield Attendance.from_dict(record)
+            if len(result.data) < page_size:
+                return
+            cursor = (result.data[-1]['date'], result.data[-1]['attendance_id'])
+    
+    @staticmethod
+    def _apply_attendance_filters(query, filters: Dict[str, Any] = None):
+        """Apply get_attendance_records filters to an attendance query"""
+        if filters:
+            for key, value in filters.items():
+                if key == 'student_id':
+                    query = query.eq('student_id', value)
+                elif key == 'subject_id':
+                    query = query.eq('subject_id', value)
+                elif key == 'subject_ids':
+                    query = query.in_('subject_id', value)
+                elif key == 'date':
+                    query = query.eq('date', value)
+                elif key == 'start_date':
+                    query = query.gte('date', value)
+                elif key == 'end_date':
+                    query = query.lte('date', value)
+                elif key == 'from_class_date':
+                    query = query.gte('class_date', value)
+                elif key == 'to_class_date':
+                    query = query.lte('class_date', value)
+        return query
+    
+    def get_attendance_summaries(self, filters: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Count attendance per student and status in one grouped query"""
+        filters = filters or {}
         try:
-            result = self.supabase.table('attendance').insert(attendance.to_dict()).execute()
-            return True
+            result = self.supabase.rpc('attendance_summary', {
+                'p_subject_id': filters.get('subject_id'),
+                'p_start_date': filters.get('start_date'),
+                'p_end_date': filters.get('end_date')
+            }).execute()
+            summary = result.data
+            return {
+                'students': {
+                    row['student_id']: {
+                        'present_count': row['present_count'],
+                        'absent_count': row['absent_count'],
+                        'late_count': row['late_count'],
+                        'total_classes': row['total_classes']
+                    }
+                    for row in summary['students']
+                },
+                'total_days': summary['total_days']
+            }
         except Exception as e:
-            logger.error(f"Error adding attendance record: {e}")
-            return False
\ No newline at end of file
+            logger.error(f"Error aggregating attendance, counting records instead: {e}")
+            return super().get_attendance_summaries(filters)
+    
+    def add_attendance_record(self, attendance: Attendance) -> bool:
+        """Add an attendance record"""
+        return self.add_attendance_records([attendance]) == 1
+    
+    def add_attendance_records(self, records: List[Attendance]) -> int:
+        """
+        Add several attendance records with multi-row upserts
+        
+        Records are keyed by (student_id, subject_id, class_date). Records
+        already stored for a class are left alone unless the new status takes
+        precedence (present over absent). A first upload of a class is only
+        inserts; a repeated upload also sends status-filtered updates, which
+        change no rows unless a status was raised.
+        """
+        stored = 0
+        batch_size = config.ATTENDANCE_INSERT_BATCH_SIZE
+        for start in range(0, len(records), batch_size):
+            chunk = records[start:start + batch_size]
+            try:
+                result = self.supabase.table('attendance').upsert(
+                    [attendance.to_dict() for attendance in chunk],
+                    on_conflict=self.ATTENDANCE_KEY,
+                    ignore_duplicates=True
+                ).execute()
+                # Only rows that hit an existing record can need promoting; the response holds the inserted ones
+                inserted = {
+                    (record['student_id'], record['subject_id'], record['class_date'])
+                    for record in result.data or []
+                }
+                self._promote_attendance([
+                    attendance for attendance in chunk
+                    if (attendance.student_id, attendance.subject_id, attendance.to_dict()['class_date']) not in inserted
+                ])
+                stored += len(chunk)
+            except Exception as e:
+                logger.error(f"Error adding attendance records {start}-{start + len(chunk) - 1}: {e}")
+        return stored
+    
+    def _promote_attendance(self, records: List[Attendance]):
+        """Raise stored records of a class to a stronger status from the new records"""
+        promotions = {}
+        for attendance in records:
+            class_date = attendance.to_dict()['class_date']
+            promotions.setdefault((attendance.subject_id, class_date, attendance.status), []).append(attendance.student_id)
+        
+        for (subject_id, class_date, status), student_ids in promotions.items():
+            if status not in Attendance.STATUS_PRECEDENCE:
+                continue
+            weaker = Attendance.STATUS_PRECEDENCE[:Attendance.STATUS_PRECEDENCE.index(status)]
+            if not weaker:
+                continue
+            batch_size = config.SUPABASE_IN_FILTER_BATCH_SIZE
+            for start in range(0, len(student_ids), batch_size):
+                query = self.supabase.table('attendance').update({'status': status})
+                query = query.eq('subject_id', subject_id).eq('class_date', class_date)
+                query.in_('student_id', student_ids[start:start + batch_size]).in_('status', list(weaker)).execute()
@@ -0,0 +1,24 @@
+-- One attendance record per student, subject and class date
+
+alter table attendance add column if not exists class_date date;
+
+update attendance set class_date = date::date where class_date is null;
+
+-- Collapse duplicates from repeated uploads, keeping the strongest status
+delete from attendance
+using (
+    select attendance_id,
+           row_number() over (
+               partition by student_id, subject_id, class_date
+               order by case status when 'present' then 0 when 'late' then 1 else 2 end, "timestamp"
+           ) as duplicate_rank
+    from attendance
+) ranked
+where attendance.attendance_id = ranked.attendance_id
+  and ranked.duplicate_rank > 1;
+
+alter table attendance alter column class_date set not null;
+
+alter table attendance
+    add constraint attendance_student_subject_class_date_key
+    unique (student_id, subject_id, class_date);
@@ -0,0 +1,34 @@
+-- Attendance counts per student and the number of class days, in one query
+
+create or replace function attendance_summary(
+    p_subject_id text default null,
+    p_start_date timestamptz default null,
+    p_end_date timestamptz default null
+)
+returns json
+language sql
+stable
+as $$
+    with filtered as (
+        select student_id, status, class_date
+        from attendance
+        where (p_subject_id is null or subject_id = p_subject_id)
+          and (p_start_date is null or date >= p_start_date)
+          and (p_end_date is null or date <= p_end_date)
+    )
+    select json_build_object(
+        'students', coalesce((
+            select json_agg(counts)
+            from (
+                select student_id,
+                       count(*) filter (where status = 'present') as present_count,
+                       count(*) filter (where status = 'absent') as absent_count,
+                       count(*) filter (where status = 'late') as late_count,
+                       count(*) as total_classes
+                from filtered
+                group by student_id
+            ) counts
+        ), '[]'::json),
+        'total_days', (select count(distinct class_date) from filtered)
+    );
+$$;
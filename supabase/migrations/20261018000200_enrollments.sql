@@ -0,0 +1,13 @@
+-- Enrollments as one row per student and subject, replacing the
+-- subjects.enrolled_students and students.course_enrolled_ids arrays.
+-- Copy existing arrays with: python migrate_enrollments.py
+
+create table if not exists enrollments (
+    student_id text not null references students (student_id) on delete cascade,
+    subject_id text not null references subjects (subject_id) on delete cascade,
+    enrolled_at timestamptz not null default now(),
+    primary key (student_id, subject_id)
+);
+
+-- The primary key serves lookups by student; this serves lookups by subject
+create index if not exists enrollments_subject_id_student_id on enrollments (subject_id, student_id);
@@ -0,0 +1,3 @@
+-- Serves attendance reads paginated by (date, attendance_id)
+
+create index if not exists attendance_date_attendance_id on attendance (date, attendance_id);